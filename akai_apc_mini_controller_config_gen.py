@@ -1,7 +1,7 @@
 """A script to generate the controller config yaml file, suitable for the AKAI APC mini midi controller."""
 
 import yaml
-from controller_config import ControllerChannel, ControllerEndpoint, ControllerConfig, ControllerKey, MidiDevice
+from controller_config import ControllerChannel, ControllerEndpoint, ControllerConfig, ControllerDevice, ControllerKey, MidiDevice
 
 if __name__ == "__main__":
     keys = [
@@ -13,11 +13,15 @@ if __name__ == "__main__":
         for id in range(8)
     ]
     conf = ControllerConfig(
-        keys=keys,
-        channels=channels,
-        master_channel=ControllerEndpoint(id_code=56),
-        master_stop=ControllerEndpoint(id_code=119),
-        device=MidiDevice(input_id=1, output_id=4)
+        devices=[
+            ControllerDevice(
+                keys=keys,
+                channels=channels,
+                master_channel=ControllerEndpoint(id_code=56),
+                master_stop=ControllerEndpoint(id_code=119),
+                device=MidiDevice(input_id=1, output_id=4)
+            )
+        ]
     )
     with open("controller_config.yaml", "w") as ofile:
         ofile.write("""# yaml-language-server: $schema=controller_config_schema.json
@@ -0,0 +1,103 @@
+"""A module to write the soundboard yaml file and its html overview in a background thread."""
+import os
+import pathlib
+import stat
+import sys
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import jinja2
+import yaml
+
+import sound_config
+
+YAML_HEADER = """# yaml-language-server: $schema=sound_config_schema.json
+
+"""
+# the libyaml based dumper is much faster, if pyyaml is built with it
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+OVERVIEW_TEMPLATE = "overview.html.template"
+# the umask can only be read by setting it, which is done once at the import and not while other threads create files
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+def write_atomic(path: str | pathlib.Path, text: str):
+    """
+    Write a text file via a temporary file in the same folder, so the file is either completely written or unchanged.
+    The file keeps the permissions of the replaced file, a new file gets the permissions of a normally created file.
+    """
+    path = pathlib.Path(path)
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        # mkstemp creates the file only readable by the user
+        os.chmod(tmp_path, mode)
+        with os.fdopen(fd, "w", encoding="utf-8") as ofile:
+            ofile.write(text)
+            ofile.flush()
+            os.fsync(ofile.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def get_overview_grid(config: sound_config.SoundConfig, dimensions: tuple[int, int]) -> list[list[str]]:
+    """
+    Returns the texts of the entries as rows of the printed grid, the top row first.
+    """
+    grid = [ [''] * dimensions[0] for _ in range(dimensions[1])]
+    for se in config.sounds:
+        grid[dimensions[1] - 1 - se.y][se.x] = se.text
+    return grid
+
+class BoardWriter:
+    """A class to save soundboards in a single background thread, so saves are written in order."""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="BoardWriter")
+        # compiled on the first save
+        self.template: jinja2.Template | None = None
+
+    def save(self, config: sound_config.SoundConfig, path: str, dimensions: tuple[int, int], with_overview: bool = True) -> Future:
+        """
+        Save the soundboard to a yaml file and the printable overview to an html file with the same base name.
+
+        The config is copied in the calling thread, so it can be changed while the files are written.
+
+        Args:
+            config(sound_config.SoundConfig): The soundboard to save.
+            path(str): The path of the yaml file.
+            dimensions(tuple[int, int]): The size of the grid.
+            with_overview(bool): If False, only the yaml file is written.
+
+        """
+        data = config.model_dump(mode="json")
+        grid = get_overview_grid(config, dimensions) if with_overview else None
+        return self.executor.submit(self._write, data, grid, path, dimensions)
+
+    def _write(self, data: dict, grid: list[list[str]] | None, path: str, dimensions: tuple[int, int]):
+        write_atomic(path, YAML_HEADER + yaml.dump(data, Dumper=YAML_DUMPER, indent=2))
+        if grid is not None:
+            html = self._get_template().render(rows=grid, width = 100.0 / dimensions[0])
+            write_atomic(pathlib.Path(path).with_suffix(".html"), html)
+
+    def _get_template(self) -> jinja2.Template:
+        if self.template is None:
+            template_dir = pathlib.Path(".")
+            if hasattr(sys, "_MEIPASS"):
+                template_dir = pathlib.Path(sys._MEIPASS)
+            env = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(template_dir),
+                autoescape=jinja2.select_autoescape(["html", "xml"])
+            )
+            self.template = env.get_template(OVERVIEW_TEMPLATE)
+        return self.template
+
+    def shutdown(self):
+        """
+        Wait for the pending saves.
+        """
+        self.executor.shutdown(wait=True)
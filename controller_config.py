@@ -1,5 +1,5 @@
 """A module to handle the midi device configuration file."""
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 import json
 import yaml
 import sys
@@ -23,14 +23,26 @@ class MidiDevice(BaseModel):
     input_id: int
     output_id: int
 
-class ControllerConfig(BaseModel):
-    """The combination of all needed information to describe the midi device."""
-    keys: list[ControllerKey]
-    channels: list[ControllerChannel]
-    master_channel: ControllerEndpoint
-    master_stop: ControllerEndpoint
+class ControllerDevice(BaseModel):
+    """The combination of all needed information to describe one midi device."""
+    keys: list[ControllerKey] = []
+    channels: list[ControllerChannel] = []
+    master_channel: ControllerEndpoint | None = None
+    master_stop: ControllerEndpoint | None = None
     device: MidiDevice
 
+class ControllerConfig(BaseModel):
+    """All midi devices used at the same time, each with its own key and channel mapping."""
+    devices: list[ControllerDevice]
+
+    @model_validator(mode="before")
+    @classmethod
+    def convert_single_device(cls, data):
+        """Accept the old file layout, which describes exactly one device at the top level."""
+        if isinstance(data, dict) and "devices" not in data and "device" in data:
+            return {"devices": [data]}
+        return data
+
 
 def get_controller_config() -> ControllerConfig:
     """Open and return the default controller configuration yaml file."""
@@ -2,19 +2,32 @@
 
 import controller_config
 import asyncio
+import heapq
+import threading
+import time
 from pygame import midi
 from dataclasses import dataclass
-from sound_manager import SoundState
-from sound_config import SoundPlayMode
+from profiling import NO_SPAN, tracer
+from sound_config import SoundPlayMode, SoundState
 
 midi.init()
 
+# the input devices are polled in a thread, a message waits at most this long before it is dispatched
+MIDI_POLL_INTERVAL = 0.001
+MIDI_READ_COUNT = 300
+
 @dataclass
 class Controller_KeyHit:
     """Represents an key hit event at position xy."""
     x: int
     y: int
 
+@dataclass
+class Controller_KeyRelease:
+    """Represents that the key at position xy is released."""
+    x: int
+    y: int
+
 @dataclass
 class Controller_MasterStop:
     """Represents that the global stop key is hit."""
@@ -38,112 +51,94 @@ class Controller_SetState:
     y: int
     state: SoundState
 
-class ControllerManager:
-    """A class to communicate with the midi device."""
+class ControllerDeviceManager:
+    """A class to communicate with one of the configured midi devices."""
 
-    def __init__(self, config_ref: controller_config.ControllerConfig):
+    def __init__(self, config_ref: controller_config.ControllerDevice, index: int = 0, open_device: bool = True):
         """
         Initialize the class and open the midi device.
-        
+
         Args:
-            config_ref(controller_config.ControllerConfig): The controller configuration.
+            config_ref(controller_config.ControllerDevice): The configuration of this device.
+            index(int): The position of the device in the controller configuration.
+            open_device(bool): If False, the midi device is not opened, e.g. to replay a recorded session.
 
         """
         self.config_ref = config_ref
+        self.index = index
 
-        self.keys: dict[int, object] = {}
+        self.keys: dict[int, controller_config.ControllerKey] = {}
+        self.key_positions: dict[tuple[int, int], controller_config.ControllerKey] = {}
         for key in self.config_ref.keys:
             self.keys[key.id_code] = key
+            self.key_positions[(key.x, key.y)] = key
 
-        self.channels: dict[int, object] = {}
+        self.channels: dict[int, controller_config.ControllerChannel] = {}
         for channel in self.config_ref.channels:
             self.channels[channel.id_code] = channel
 
         self.master_channel = self.config_ref.master_channel
         self.master_stop = self.config_ref.master_stop
 
-        try:
-            self.input_device = midi.Input(self.config_ref.device.input_id)
-            self.output_device = midi.Output(self.config_ref.device.output_id)
-        except Exception:
-            self.input_device = None
-            self.output_device = None
+        self.input_device = None
+        self.output_device = None
+        if open_device:
+            try:
+                self.input_device = midi.Input(self.config_ref.device.input_id)
+                self.output_device = midi.Output(self.config_ref.device.output_id)
+            except Exception:
+                self.input_device = None
+                self.output_device = None
 
-        self.event_handler = None
-
-    def is_device_opened_successfully(self) -> tuple[bool, bool]:
+    def read(self, count: int) -> list[tuple[int, "ControllerDeviceManager", list[int]]]:
         """
-        Returns True or False for the input and output device, if they are opened successfully.
+        Returns the pending midi messages as tuples of timestamp, device and data, ordered by the timestamp.
         """
-        return self.input_device is not None, self.output_device is not None
+        if self.input_device is None or not self.input_device.poll():
+            return []
+        return [(ts, self, data) for data, ts in self.input_device.read(count)]
 
-    def set_event_handler(self, handler = None):
+    def decode(self, data: list[int]) -> object | None:
         """
-        Set the event handler to call for new events.
-
-        Args:
-            handler: A callable which is called with an object of the event type.
-        
+        Returns the event for a raw midi message or None if the message is not mapped.
         """
-        self.event_handler = handler
-
-    def _call_event(self, data: object):
-        """
-        Call the event handler if set.
-        
-        Args:
-            data: The arguments to pass to the handler.
-
-        """
-        if self.event_handler is not None:
-            self.event_handler(data)
-        
-    async def listen(self):
-        """
-        The midi event process function to be called asynchronous.
-        """
-        if self.input_device is None:
-            while True:
-                await asyncio.sleep(1)
-        while True:
-            evt_lst = self.input_device.read(300)
-            for evt_entry in evt_lst:
-                data, _ = evt_entry
-                st, d1, d2, _ = data
-                code = (st & 0xF0) >> 4
-                try:
-                    match code:
-                        case 0x9:
-                            # Key On
-                            if self.check_for_master_stop(d1):
-                                self._call_event(Controller_MasterStop())
-                            else:
-                                x,y = self.get_xy_for_key(d1)
-                                self._call_event(Controller_KeyHit(x, y))
-                        case 0x8:
-                            pass # Key Off currently not used
-                        case 0xB:
-                            # Control
-                            if self.check_for_master_volume(d1):
-                                self._call_event(Controller_MasterVolume(d2))
-                            else:
-                                x = self.get_x_for_channel(d1)
-                                self._call_event(Controller_SetVolume(x, d2))
-                except KeyError:
-                    pass
-            await asyncio.sleep(0.1)
+        st, d1, d2, _ = data
+        code = (st & 0xF0) >> 4
+        try:
+            match code:
+                case 0x9 if d2 > 0:
+                    # Key On
+                    if self.check_for_master_stop(d1):
+                        return Controller_MasterStop()
+                    x, y = self.get_xy_for_key(d1)
+                    return Controller_KeyHit(x, y)
+                case 0x8 | 0x9:
+                    # Key Off, some devices send a Key On with velocity 0 instead
+                    if self.check_for_master_stop(d1):
+                        return None
+                    x, y = self.get_xy_for_key(d1)
+                    return Controller_KeyRelease(x, y)
+                case 0xB:
+                    # Control
+                    if self.check_for_master_volume(d1):
+                        return Controller_MasterVolume(d2)
+                    x = self.get_x_for_channel(d1)
+                    return Controller_SetVolume(x, d2)
+        except KeyError:
+            pass
+        return None
 
     def check_for_master_stop(self, id: int) -> bool:
         """
         Check if the key code is identical to the configured master stop key code.
         """
-        return self.master_stop.id_code == id
+        return self.master_stop is not None and self.master_stop.id_code == id
     
     def check_for_master_volume(self, id: int) -> bool:
         """
         Check if the control code is identical to the configured master volume control code.
         """
-        return self.master_channel.id_code == id
+        return self.master_channel is not None and self.master_channel.id_code == id
 
     def get_xy_for_key(self, id: int) -> tuple[int, int]:
         """
@@ -152,13 +147,11 @@ class ControllerManager:
         entry = self.keys[id]
         return entry.x, entry.y
         
-    def get_key_for_xy(self, x: int, y: int) -> controller_config.ControllerKey:
+    def get_key_for_xy(self, x: int, y: int) -> controller_config.ControllerKey | None:
         """
         Returns the key entry for the given x and y coordinates. Returns None if the coordinates don't match any key entry.
         """
-        for key in self.keys.values():
-            if key.x == x and key.y == y:
-                return key
+        return self.key_positions.get((x, y))
         
     def get_x_for_channel(self, id: int) -> int:
         """
@@ -174,7 +167,7 @@ class ControllerManager:
             return
         
         try:
-            pad_id = self.get_key_for_xy(state.x, state.y).id_code
+            pad_id = self.key_positions[(state.x, state.y)].id_code
             
             match state.state.mode:
                 case SoundPlayMode.PLAY:
@@ -183,6 +176,8 @@ class ControllerManager:
                     color = 45 # #0000FF
                 case SoundPlayMode.PLAY_AND_STOP:
                     color = 21 # #00FF00
+                case SoundPlayMode.GATE:
+                    color = 13 # #FFFF00
 
             cmd = 0x94
             if state.state.paused:
@@ -190,10 +185,142 @@ class ControllerManager:
             if not state.state.playing:
                 color = 0x00
 
-            self.output_device.write_short(cmd, pad_id, color)
+            with tracer.span("ControllerDeviceManager.set_state"):
+                self.output_device.write_short(cmd, pad_id, color)
         except KeyError:
             pass
 
+class ControllerManager:
+    """A class to communicate with all configured midi devices."""
+
+    def __init__(self, config_ref: controller_config.ControllerConfig, open_devices: bool = True):
+        """
+        Initialize the class and open all midi devices.
+        
+        Args:
+            config_ref(controller_config.ControllerConfig): The controller configuration.
+            open_devices(bool): If False, no midi device is opened, e.g. to replay a recorded session.
+
+        """
+        self.config_ref = config_ref
+
+        self.devices = [
+            ControllerDeviceManager(device, index, open_devices)
+            for index, device in enumerate(self.config_ref.devices)
+        ]
+
+        # the devices which display a key at a position, used to route the key colors
+        self.key_displays: dict[tuple[int, int], list[ControllerDeviceManager]] = {}
+        for device in self.devices:
+            for xy in device.key_positions:
+                self.key_displays.setdefault(xy, []).append(device)
+
+        self.event_handler = None
+        self.recorder = None
+
+    def is_device_opened_successfully(self) -> tuple[bool, bool]:
+        """
+        Returns True or False for the input and output devices, if all of them are opened successfully.
+        """
+        return (
+            all(device.input_device is not None for device in self.devices),
+            all(device.output_device is not None for device in self.devices)
+        )
+
+    def set_event_handler(self, handler = None):
+        """
+        Set the event handler to call for new events.
+
+        Args:
+            handler: A callable which is called with an object of the event type.
+        
+        """
+        self.event_handler = handler
+
+    def set_recorder(self, recorder = None):
+        """
+        Set the recorder which receives every raw midi message before it is dispatched.
+
+        Args:
+            recorder: An object with a write(timestamp, device_index, data) method, e.g. a midi_recorder.MidiRecorder.
+
+        """
+        self.recorder = recorder
+
+    def _call_event(self, data: object):
+        """
+        Call the event handler if set.
+        
+        Args:
+            data: The arguments to pass to the handler.
+
+        """
+        if self.event_handler is not None:
+            self.event_handler(data)
+        
+    async def listen(self, poll_interval: float = MIDI_POLL_INTERVAL):
+        """
+        The midi event process function to be called asynchronous.
+
+        All opened input devices are polled in one thread. Their messages are merged by the
+        timestamp into a single stream, so the events are handled in the order they occurred.
+        Every batch is dispatched in the thread of the event loop as soon as it is read, so e.g.
+        a key release is not delayed by a sleep of the event loop.
+
+        Args:
+            poll_interval(float): The time in seconds the thread waits while no message is pending.
+
+        """
+        loop = asyncio.get_running_loop()
+        input_devices = [device for device in self.devices if device.input_device is not None]
+        if len(input_devices) == 0:
+            # wait until cancelled
+            await loop.create_future()
+
+        def dispatch_batches(batches: list[list]):
+            with tracer.span("ControllerManager.listen", {"messages": sum(len(b) for b in batches)}) if tracer.enabled else NO_SPAN:
+                self.dispatch(heapq.merge(*batches, key=lambda e: e[0]))
+
+        stopped = threading.Event()
+        def poll_devices():
+            while not stopped.is_set():
+                batches = [device.read(MIDI_READ_COUNT) for device in input_devices]
+                if any(batches):
+                    loop.call_soon_threadsafe(dispatch_batches, batches)
+                else:
+                    # time.sleep uses a high resolution timer on Windows, unlike Event.wait
+                    time.sleep(poll_interval)
+
+        thread = threading.Thread(target=poll_devices, name="MidiInput", daemon=True)
+        thread.start()
+        try:
+            await loop.create_future()
+        finally:
+            stopped.set()
+            thread.join()
+
+    def dispatch(self, messages):
+        """
+        Decode raw midi messages and call the event handler for each mapped event.
+
+        Args:
+            messages: An iterable of tuples of timestamp, device and raw midi data, ordered by the timestamp.
+
+        """
+        for ts, device, data in messages:
+            if self.recorder is not None:
+                self.recorder.write(ts, device.index, data)
+            event = device.decode(data)
+            if event is not None:
+                self._call_event(event)
+
+    def set_state(self, state: Controller_SetState):
+        """
+        Sends the new state to every midi device which displays a key at the position.
+        """
+        for device in self.key_displays.get((state.x, state.y), []):
+            device.set_state(state)
+
 def get_midi_device_list():
     result = []
     for i in range(midi.get_count()):
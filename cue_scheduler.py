@@ -0,0 +1,178 @@
+"""A module to trigger timed cues, with a heap of the pending cues and a single timer of the asyncio event loop."""
+import asyncio
+import heapq
+import itertools
+import sys
+import traceback
+from typing import Callable
+
+# the event loop of Windows wakes up with the 15.6 ms period of the system timer, so it is woken up earlier
+# and the remaining time is passed by yielding to the other callbacks of the loop
+CUE_EARLY_WAKEUP = 0.016 if sys.platform == "win32" else 0.001
+# a cue which is due in less than this time is triggered at once
+CUE_TOLERANCE = 0.0001
+
+class CueScheduler:
+    """
+    A class to call a handler with cues at given times.
+
+    The pending cues are stored in a heap, ordered by the due time and the order they were scheduled in. Only the
+    earliest cue has a timer in the event loop, so thousands of pending cues cost one heap entry each, and cancelling
+    all of them only clears the heap.
+
+    Without a clock, the time of the running event loop is used. With a clock, no timer is started and the owner
+    calls run_due, e.g. for an offline render in the time of a script.
+    """
+
+    def __init__(self, handler: Callable[[object], None], clock: Callable[[], float] | None = None):
+        """
+        Args:
+            handler(Callable): Called with every cue when it is due.
+            clock(Callable): Returns the current time in seconds, None for the time of the running event loop.
+
+        """
+        self.handler = handler
+        self.clock = clock
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.heap: list[tuple[float, int, object]] = []
+        self.counter = itertools.count()
+        # incremented by cancel_all, so the cues which are taken from the heap already are dropped too
+        self.generation = 0
+        self.timer: asyncio.TimerHandle | asyncio.Handle | None = None
+        self.timer_due: float | None = None
+
+    def time(self) -> float:
+        if self.clock is not None:
+            return self.clock()
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        return self.loop.time()
+
+    def schedule(self, delay: float, cue: object):
+        """
+        Call the handler with the cue after the delay in seconds.
+        """
+        due = self.time() + delay
+        heapq.heappush(self.heap, (due, next(self.counter), cue))
+        if self.heap[0][0] == due:
+            self._arm()
+
+    def cancel_all(self):
+        """
+        Remove all pending cues.
+        """
+        self.heap.clear()
+        self.generation += 1
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+            self.timer_due = None
+
+    def pending(self) -> int:
+        return len(self.heap)
+
+    def next_due(self) -> float | None:
+        """
+        Returns the time of the earliest pending cue, None if there is none.
+        """
+        if len(self.heap) == 0:
+            return None
+        return self.heap[0][0]
+
+    def run_due(self) -> int:
+        """
+        Call the handler with all cues which are due. Returns the number of triggered cues.
+
+        A cue which is scheduled by the handler without a delay is triggered by the next call, so a chain of cues
+        can't block the caller. An exception of the handler is printed and doesn't stop the other due cues.
+        """
+        end = self.time() + CUE_TOLERANCE
+        heap = self.heap
+        due_cues = []
+        while len(heap) > 0 and heap[0][0] <= end:
+            due_cues.append(heapq.heappop(heap)[2])
+        generation = self.generation
+        count = 0
+        for cue in due_cues:
+            if self.generation != generation:
+                # cancelled by the handler, e.g. by a master stop
+                break
+            try:
+                self.handler(cue)
+            except Exception:
+                print(f"The cue {cue} failed:")
+                traceback.print_exc()
+            count += 1
+        return count
+
+    def _arm(self):
+        """
+        Start the timer of the event loop for the earliest pending cue, if it isn't running for that time already.
+        """
+        if self.clock is not None or len(self.heap) == 0:
+            return
+        due = self.heap[0][0]
+        if self.timer is not None:
+            if self.timer_due == due:
+                return
+            self.timer.cancel()
+        now = self.time()
+        self.timer_due = due
+        if due - now <= CUE_EARLY_WAKEUP:
+            self.timer = self.loop.call_soon(self._on_timer)
+        else:
+            self.timer = self.loop.call_at(due - CUE_EARLY_WAKEUP, self._on_timer)
+
+    def _on_timer(self):
+        self.timer = None
+        self.timer_due = None
+        heap = self.heap
+        try:
+            if len(heap) > 0 and heap[0][0] <= self.time() + CUE_TOLERANCE:
+                self.run_due()
+        finally:
+            # the remaining cues are triggered even if the handling of these failed
+            self._arm()
+
+if __name__ == "__main__":
+    """
+    Measure how late the cues are triggered, while thousands of cues are pending, and the cost to schedule
+    and to cancel them.
+    """
+    import random
+    import time
+
+    from profiling import format_quantity
+
+    async def benchmark(count: int = 10000, span: float = 2.0):
+        loop = asyncio.get_running_loop()
+        lateness = []
+        def handler(due: float):
+            lateness.append(loop.time() - due)
+        scheduler = CueScheduler(handler)
+
+        start = time.perf_counter()
+        for _ in range(count):
+            # later than the time to schedule all cues
+            delay = random.uniform(0.1, span)
+            # the cue is its due time, scheduler.time() is the same clock
+            scheduler.schedule(delay, scheduler.time() + delay)
+        schedule_duration = time.perf_counter() - start
+        await asyncio.sleep(span + 0.1)
+
+        for _ in range(count):
+            scheduler.schedule(random.uniform(1.0, span), 0.0)
+        start = time.perf_counter()
+        scheduler.cancel_all()
+        cancel_duration = time.perf_counter() - start
+
+        values = sorted(lateness)
+        print(f"Scheduled {count} cues in {format_quantity(schedule_duration, 's', 'ms')}, "
+              f"cancelled {count} cues in {format_quantity(cancel_duration, 's', 'ms', 2)}")
+        print(f"Triggered {len(values)} cues, lateness: "
+              f"median {format_quantity(values[len(values) // 2], 's', 'ms', 3)}, "
+              f"99th percentile {format_quantity(values[len(values) * 99 // 100], 's', 'ms', 3)}, "
+              f"max {format_quantity(values[-1], 's', 'ms', 3)}, "
+              f"earliest {format_quantity(values[0], 's', 'ms', 3)}")
+
+    asyncio.run(benchmark())
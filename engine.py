@@ -0,0 +1,90 @@
+"""A module which connects the events of the midi devices with the sound playback."""
+import asyncio
+
+from controller_manager import ControllerManager, Controller_SetVolume, Controller_KeyHit, Controller_KeyRelease, Controller_MasterStop, Controller_MasterVolume, Controller_SetState, get_midi_device_list
+from osc_server import OscServer
+from profiling import RuntimeProfiler
+from sample_store import format_memory_usage
+from sound_config import SoundConfig, copy_sound_config
+from sound_manager import SoundManager, SoundEntryManager
+
+def connect_managers(cm: ControllerManager, sm: SoundManager, osc_server: OscServer | None = None):
+    """
+    Route the midi events to the sound manager and the sound state changes back to the midi devices.
+
+    Only the midi devices and the OSC subscribers are sent every change. Other consumers, e.g. the ui_manager.UiStateQueue,
+    read the changes from sm.state_table when they need them.
+
+    Args:
+        cm(ControllerManager): The manager of the midi devices.
+        sm(SoundManager): The manager of the sound playback.
+        osc_server(OscServer): An optional OSC server, which triggers the same events as the midi devices.
+
+    """
+    state_table = sm.state_table
+    def midi_handler(event):
+        match event:
+            case Controller_KeyHit(x, y):
+                sm.hit_note(x, y)
+            case Controller_KeyRelease(x, y):
+                sm.release_note(x, y)
+            case Controller_MasterStop():
+                sm.stop()
+            case Controller_SetVolume(x, v_int):
+                sm.set_volume(x, v_int / 127.0)
+            case Controller_MasterVolume(v_int):
+                sm.set_master_volume(v_int / 127.0)
+    cm.set_event_handler(midi_handler)
+    if osc_server is not None:
+        osc_server.set_event_handler(midi_handler)
+
+    def sound_handler(sound: SoundEntryManager):
+        x, y = sound.get_xy()
+        state_event = Controller_SetState(x, y, state_table.get_state(x, y))
+        cm.set_state(state_event)
+        if osc_server is not None:
+            osc_server.set_state(state_event)
+    sm.set_change_handler(sound_handler)
+
+async def run_ticker(sm: SoundManager, interval: float = 0.1):
+    """
+    Call the tick of the sound manager regularly, to notice the sounds which ended.
+    """
+    while True:
+        sm.tick()
+        await asyncio.sleep(interval)
+
+def create_request_handler(cm: ControllerManager, sm: SoundManager, profiler: RuntimeProfiler):
+    """
+    Returns the handler for the requests of the UI, which are passed by the name of the ui_manager.UiManagerRequests member.
+
+    Args:
+        cm(ControllerManager): The manager of the midi devices.
+        sm(SoundManager): The manager of the sound playback.
+        profiler(RuntimeProfiler): The profiler of the engine.
+
+    """
+    def request_handler(request: str, *args):
+        match request:
+            case "GET_SOUND_ERROR_POSITIONS":
+                return sm.get_xy_for_disabled_sounds()
+            case "RELOAD_AFTER_CONFIG_CHANGE":
+                if len(args) > 0:
+                    # the config is passed, if the engine runs in a separate process
+                    copy_sound_config(sm.config_ref, SoundConfig(**args[0]))
+                sm.reload_changed_config()
+            case "GET_MIDI_DEVICES":
+                return get_midi_device_list()
+            case "GET_DEVICE_OPEN_STATE":
+                return cm.is_device_opened_successfully()
+            case "TOGGLE_PROFILING":
+                return profiler.toggle_profiling()
+            case "TOGGLE_TRACING":
+                return profiler.toggle_tracing()
+            case "TAKE_MEMORY_SNAPSHOT":
+                return profiler.take_memory_snapshot(format_memory_usage(*sm.get_memory_usage()))
+            case "GET_MEMORY_USAGE":
+                return format_memory_usage(*sm.get_memory_usage())
+            case _:
+                raise ValueError(f"Unknown request: {request}")
+    return request_handler
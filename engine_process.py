@@ -0,0 +1,424 @@
+"""A module to run the sound playback and the midi devices in a separate process, controlled over shared memory ring buffers."""
+import asyncio
+import collections
+import enum
+import itertools
+import json
+import multiprocessing
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import controller_config
+import sound_config
+from shared_ring import SharedRingBuffer, DEFAULT_CAPACITY
+from sound_state_table import PLAY_MODES, MODE_INDEXES, SoundStateTable
+
+# the time a ring reader sleeps while its ring is empty
+RING_POLL_INTERVAL = 0.0005
+# how often the engine checks if the process which started it still exists
+PARENT_CHECK_INTERVAL = 1.0
+SHUTDOWN_TIMEOUT = 2.0
+# how often the engine tries to send the states again while the state ring is full
+STATE_RETRY_INTERVAL = 0.05
+
+class EngineOp(enum.IntEnum):
+    """The first byte of every message on the rings."""
+    # commands to the engine
+    HIT = 1
+    VOLUME = 2
+    MASTER_VOLUME = 3
+    STOP = 4
+    REQUEST = 5
+    PING = 6
+    QUIT = 7
+    RELEASE = 8
+    # messages from the engine
+    STATE = 16
+    RESPONSE = 17
+    PONG = 18
+
+MSG_OP = struct.Struct("<B")
+MSG_XY = struct.Struct("<Bhh")
+MSG_VALUE = struct.Struct("<Bh")
+MSG_REQUEST = struct.Struct("<BI")
+MSG_PING = struct.Struct("<BIq")
+MSG_STATE = struct.Struct("<BhhBBB")
+MSG_RESPONSE = struct.Struct("<BIB")
+
+def _poll_ring(ring: SharedRingBuffer, handler, is_running):
+    """
+    Pass the messages of the ring to the handler in batches, until is_running returns False.
+    """
+    while is_running():
+        messages = ring.read_all()
+        if len(messages) > 0:
+            handler(messages)
+        else:
+            time.sleep(RING_POLL_INTERVAL)
+
+def _engine_main(command_ring: tuple, state_ring: tuple, controller_data: dict, sound_data: dict, options: dict):
+    """
+    The entry point of the engine process.
+    """
+    asyncio.run(_run_engine(command_ring, state_ring, controller_data, sound_data, options))
+
+async def _run_engine(command_ring: tuple, state_ring: tuple, controller_data: dict, sound_data: dict, options: dict):
+    # imported here, the sound manager opens the audio device on import
+    from controller_manager import ControllerManager
+    from engine import connect_managers, create_request_handler, run_ticker
+    from loop_watchdog import LoopWatchdog
+    from midi_recorder import MidiRecorder
+    from osc_server import OscServer
+    from profiling import RuntimeProfiler
+    from sample_store import SampleStore
+    from sound_manager import SoundManager
+    from sound_trim import SoundTrimmer, TrimCache
+
+    commands = SharedRingBuffer(*command_ring)
+    states = SharedRingBuffer(*state_ring)
+
+    watchdog = None
+    if options.get("stall_threshold", 0) > 0:
+        watchdog = LoopWatchdog("engine event loop", options["stall_threshold"])
+        watchdog.start()
+
+    trimmer = SoundTrimmer(TrimCache())
+    store = SampleStore()
+    sm = SoundManager(sound_config.SoundConfig(**sound_data), trimmer, store)
+    cm = ControllerManager(controller_config.ControllerConfig(**controller_data), open_devices=options.get("open_devices", True))
+
+    recorder = None
+    if options.get("record") is not None:
+        recorder = MidiRecorder(options["record"])
+        cm.set_recorder(recorder)
+
+    osc_server = None
+    if options.get("osc_port") is not None:
+        osc_server = OscServer(sm.state_table)
+        await osc_server.start(options.get("osc_host", "0.0.0.0"), options["osc_port"])
+
+    # the process of the ui drains the state ring regularly, so it is only full if the ui hangs. The engine never
+    # waits for it, a hanging ui mustn't delay the playback. The responses and pongs wait in a queue, the states
+    # wait by their position, so only the latest state of a pad is sent.
+    loop = asyncio.get_running_loop()
+    pending_messages = collections.deque()
+    pending_states = {}
+    state_version = 0
+    flush_handle = None
+
+    def flush():
+        # once per iteration of the loop, with the latest state of every pad which changed since the last flush
+        nonlocal state_version, flush_handle
+        flush_handle = None
+        state_version, changes = sm.state_table.get_changes_since(state_version)
+        pending_states.update(changes)
+        while len(pending_messages) > 0:
+            if not states.write(pending_messages[0]):
+                flush_handle = loop.call_later(STATE_RETRY_INTERVAL, flush)
+                return
+            pending_messages.popleft()
+        for (x, y), s in list(pending_states.items()):
+            if not states.write(MSG_STATE.pack(EngineOp.STATE, x, y, s.playing, s.paused, MODE_INDEXES[s.mode])):
+                flush_handle = loop.call_later(STATE_RETRY_INTERVAL, flush)
+                return
+            del pending_states[(x, y)]
+
+    def schedule_flush():
+        nonlocal flush_handle
+        if flush_handle is None:
+            flush_handle = loop.call_soon(flush)
+
+    def send(message: bytes):
+        if len(pending_messages) > 0 or not states.write(message):
+            pending_messages.append(message)
+            schedule_flush()
+
+    connect_managers(cm, sm, osc_server)
+    change_handler = sm.change_handler
+    def sound_handler(sound):
+        change_handler(sound)
+        schedule_flush()
+    sm.set_change_handler(sound_handler)
+    # the states of the loaded board
+    schedule_flush()
+    request_handler = create_request_handler(cm, sm, RuntimeProfiler())
+
+    stopped = loop.create_future()
+
+    def stop():
+        if not stopped.done():
+            stopped.set_result(None)
+
+    def handle_commands(messages: list[bytes]):
+        for message in messages:
+            match message[0]:
+                case EngineOp.HIT:
+                    _, x, y = MSG_XY.unpack(message)
+                    sm.hit_note(x, y)
+                case EngineOp.RELEASE:
+                    _, x, y = MSG_XY.unpack(message)
+                    sm.release_note(x, y)
+                case EngineOp.VOLUME:
+                    _, x, value = MSG_XY.unpack(message)
+                    sm.set_volume(x, value / 127.0)
+                case EngineOp.MASTER_VOLUME:
+                    _, value = MSG_VALUE.unpack(message)
+                    sm.set_master_volume(value / 127.0)
+                case EngineOp.STOP:
+                    sm.stop()
+                case EngineOp.REQUEST:
+                    _, request_id = MSG_REQUEST.unpack_from(message)
+                    name, args = json.loads(message[MSG_REQUEST.size:])
+                    try:
+                        result, ok = request_handler(name, *args), True
+                    except Exception as e:
+                        result, ok = f"{type(e).__name__}: {e}", False
+                    send(MSG_RESPONSE.pack(EngineOp.RESPONSE, request_id, ok) + json.dumps(result).encode())
+                case EngineOp.PING:
+                    send(bytes((EngineOp.PONG,)) + message[1:])
+                case EngineOp.QUIT:
+                    stop()
+
+    parent = multiprocessing.parent_process()
+    last_parent_check = time.monotonic()
+    def is_running() -> bool:
+        nonlocal last_parent_check
+        if stopped.done():
+            return False
+        now = time.monotonic()
+        if parent is not None and now - last_parent_check > PARENT_CHECK_INTERVAL:
+            last_parent_check = now
+            if not parent.is_alive():
+                loop.call_soon_threadsafe(stop)
+                return False
+        return True
+
+    command_thread = threading.Thread(
+        target=_poll_ring,
+        args=(commands, lambda messages: loop.call_soon_threadsafe(handle_commands, messages), is_running),
+        name="EngineCommands",
+        daemon=True
+    )
+    command_thread.start()
+
+    tasks = [
+        asyncio.create_task(run_ticker(sm)),
+        asyncio.create_task(cm.listen()),
+    ]
+    try:
+        await stopped
+    finally:
+        for task in tasks:
+            task.cancel()
+        command_thread.join()
+        if recorder is not None:
+            recorder.close()
+        if osc_server is not None:
+            osc_server.close()
+        trimmer.shutdown()
+        store.shutdown()
+        if watchdog is not None:
+            watchdog.stop()
+        commands.close()
+        states.close()
+
+class EngineProcess:
+    """
+    A class to run the sound manager and the midi devices in a child process.
+
+    The commands are written to one shared memory ring and the state changes and request results are read from a second one,
+    so neither side waits for a lock or a pipe. The playback is not delayed by the ui, the file checks or the yaml handling
+    of this process. Only one thread may send commands, usually the thread of the asyncio event loop.
+    """
+
+    def __init__(self, controller_config_ref: controller_config.ControllerConfig, options: dict | None = None, capacity: int = DEFAULT_CAPACITY):
+        """
+        Args:
+            controller_config_ref(ControllerConfig): The configuration of the midi devices.
+            options(dict): The options of the engine: record (path of a midi log), osc_host, osc_port and open_devices.
+            capacity(int): The size of each ring buffer in bytes.
+
+        """
+        self.controller_config_ref = controller_config_ref
+        self.options = dict(options or {})
+        self.commands = SharedRingBuffer(capacity=capacity)
+        self.states = SharedRingBuffer(capacity=capacity)
+        self.process: multiprocessing.Process | None = None
+        self.state_thread: threading.Thread | None = None
+        self.running = False
+        # the states of the engine, written by the thread which reads the state ring
+        self.state_table = SoundStateTable()
+        self.pong_handler = None
+        self.request_ids = itertools.count(1)
+        self.pending_requests: dict[int, Future] = {}
+
+    def start(self, sound_config_ref: sound_config.SoundConfig):
+        """
+        Start the engine process with the given sound configuration.
+        """
+        # a fresh interpreter, the audio and midi devices are not inherited from this process
+        context = multiprocessing.get_context("spawn")
+        self.process = context.Process(
+            target=_engine_main,
+            args=(
+                self.commands.get_attach_args(),
+                self.states.get_attach_args(),
+                self.controller_config_ref.model_dump(mode="json"),
+                sound_config_ref.model_dump(mode="json"),
+                self.options,
+            ),
+            name="SoundEngine",
+            daemon=True
+        )
+        self.process.start()
+        self.running = True
+        self.state_thread = threading.Thread(
+            target=_poll_ring,
+            args=(self.states, self._handle_messages, lambda: self.running),
+            name="EngineStates",
+            daemon=True
+        )
+        self.state_thread.start()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    async def wait(self):
+        """
+        Wait until the engine process ended.
+        """
+        while self.is_alive():
+            await asyncio.sleep(0.5)
+
+    def set_pong_handler(self, handler = None):
+        """
+        Set the function which is called with the sequence number and the send time of every answered ping.
+        """
+        self.pong_handler = handler
+
+    def _send(self, message: bytes):
+        if not self.commands.write(message):
+            raise BufferError("The command ring of the engine is full.")
+
+    def hit(self, x: int, y: int):
+        self._send(MSG_XY.pack(EngineOp.HIT, x, y))
+
+    def release(self, x: int, y: int):
+        self._send(MSG_XY.pack(EngineOp.RELEASE, x, y))
+
+    def set_volume(self, x: int, value: int):
+        self._send(MSG_XY.pack(EngineOp.VOLUME, x, value))
+
+    def set_master_volume(self, value: int):
+        self._send(MSG_VALUE.pack(EngineOp.MASTER_VOLUME, value))
+
+    def stop(self):
+        self._send(MSG_OP.pack(EngineOp.STOP))
+
+    def ping(self, sequence: int):
+        self._send(MSG_PING.pack(EngineOp.PING, sequence, time.perf_counter_ns()))
+
+    def request(self, name: str, *args) -> Future:
+        """
+        Send a request of the engine.request_handler. Returns a future with the result, the arguments and the result must be JSON values.
+
+        Args:
+            name(str): The name of the ui_manager.UiManagerRequests member.
+
+        """
+        future = Future()
+        request_id = next(self.request_ids)
+        self.pending_requests[request_id] = future
+        try:
+            self._send(MSG_REQUEST.pack(EngineOp.REQUEST, request_id) + json.dumps([name, args]).encode())
+        except Exception as e:
+            del self.pending_requests[request_id]
+            future.set_exception(e)
+        return future
+
+    def reload(self, sound_config_ref: sound_config.SoundConfig) -> Future:
+        """
+        Send the changed sound configuration to the engine.
+        """
+        return self.request("RELOAD_AFTER_CONFIG_CHANGE", sound_config_ref.model_dump(mode="json"))
+
+    def _handle_messages(self, messages: list[bytes]):
+        for message in messages:
+            match message[0]:
+                case EngineOp.STATE:
+                    _, x, y, playing, paused, mode = MSG_STATE.unpack(message)
+                    self.state_table.update(x, y, bool(playing), bool(paused), PLAY_MODES[mode])
+                case EngineOp.RESPONSE:
+                    _, request_id, ok = MSG_RESPONSE.unpack_from(message)
+                    future = self.pending_requests.pop(request_id, None)
+                    if future is None:
+                        continue
+                    result = json.loads(message[MSG_RESPONSE.size:])
+                    if ok:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(RuntimeError(result))
+                case EngineOp.PONG:
+                    _, sequence, sent = MSG_PING.unpack(message)
+                    if self.pong_handler is not None:
+                        self.pong_handler(sequence, sent)
+
+    def close(self):
+        """
+        Stop the engine process and remove the ring buffers.
+        """
+        if self.process is not None:
+            try:
+                self._send(MSG_OP.pack(EngineOp.QUIT))
+            except BufferError:
+                pass
+            self.process.join(SHUTDOWN_TIMEOUT)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.running = False
+        if self.state_thread is not None:
+            self.state_thread.join()
+        for future in self.pending_requests.values():
+            future.cancel()
+        self.pending_requests.clear()
+        self.commands.close()
+        self.states.close()
+
+if __name__ == "__main__":
+    """Measure the round trip time of a message to the engine process and back."""
+    import os
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+    from profiling import format_quantity
+
+    def benchmark(count: int = 20000):
+        engine = EngineProcess(controller_config.ControllerConfig(devices=[]), {"open_devices": False})
+        engine.start(sound_config.SoundConfig())
+
+        round_trips = []
+        answered = threading.Event()
+        def pong_handler(sequence: int, sent: int):
+            round_trips.append(time.perf_counter_ns() - sent)
+            answered.set()
+        engine.set_pong_handler(pong_handler)
+
+        # the first request is answered after the engine started
+        print(f"Midi devices seen by the engine: {engine.request('GET_MIDI_DEVICES').result(timeout=30)}")
+
+        for sequence in range(count):
+            answered.clear()
+            engine.ping(sequence)
+            answered.wait()
+        engine.close()
+
+        round_trips.sort()
+        print(f"Round trips: {len(round_trips)}")
+        print(f"Mean: {format_quantity(sum(round_trips) / len(round_trips), 'ns', 'us')}")
+        print(f"Median: {format_quantity(round_trips[len(round_trips) // 2], 'ns', 'us')}")
+        print(f"99th percentile: {format_quantity(round_trips[len(round_trips) * 99 // 100], 'ns', 'us')}")
+        print(f"Max: {format_quantity(round_trips[-1], 'ns', 'us')}")
+
+    benchmark()
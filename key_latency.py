@@ -0,0 +1,121 @@
+"""A script to measure the latency from a midi message to the sound state change, for bursts of key presses and key releases."""
+import os
+# must be set before pygame opens the mixer
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import asyncio
+import contextlib
+import io
+import tempfile
+import threading
+import time
+import wave
+from collections import deque
+
+from pygame import mixer
+
+from controller_config import ControllerConfig, ControllerDevice, ControllerKey, MidiDevice
+from controller_manager import ControllerManager
+from engine import connect_managers
+from profiling import format_quantity
+from sound_config import SoundConfig, SoundEntry, SoundPlayMode
+from sound_manager import PygameMixer, SoundManager, SoundEntryManager
+
+class SimulatedInput:
+    """The interface of pygame.midi.Input, fed by the measurement."""
+
+    def __init__(self):
+        self.messages = deque()
+
+    def poll(self) -> bool:
+        return len(self.messages) > 0
+
+    def read(self, count: int) -> list:
+        result = []
+        while len(result) < count and len(self.messages) > 0:
+            result.append(self.messages.popleft())
+        return result
+
+async def measure_key_latency(backend: PygameMixer | None = None, rounds: int = 50, width: int = 8, height: int = 8) -> dict[bool, list[int]]:
+    """
+    Measure the latency from a midi message to the sound state change, for bursts of key presses and key releases
+    on all pads of a board with gate entries. The messages are read by the polling thread of ControllerManager.listen
+    from a simulated input device. Returns the latencies in nanoseconds of the presses (True) and the releases (False).
+
+    Args:
+        backend(PygameMixer): The audio backend of the sound manager, None for the pygame mixer.
+        rounds(int): The number of bursts of presses and of releases.
+        width(int): The number of pad columns of the board.
+        height(int): The number of pad rows of the board.
+
+    """
+    if backend is None:
+        backend = PygameMixer()
+    with tempfile.TemporaryDirectory() as folder:
+        sound_path = os.path.join(folder, "silence.wav")
+        with wave.open(sound_path, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(22050)
+            wav.writeframes(bytes(22050 * 2))
+
+        pads = [(x, y) for y in range(height) for x in range(width)]
+        mixer.set_num_channels(2 * len(pads))
+        config = SoundConfig(sounds=[
+            SoundEntry(text=f"{x}/{y}", x=x, y=y, files=[sound_path], mode=SoundPlayMode.GATE)
+            for x, y in pads
+        ])
+        backend.preprocess(config).result()
+        sm = SoundManager(config, backend=backend)
+        cm = ControllerManager(ControllerConfig(devices=[ControllerDevice(
+            device=MidiDevice(input_id=0, output_id=0),
+            keys=[ControllerKey(x=x, y=y, id_code=i) for i, (x, y) in enumerate(pads)],
+        )]), open_devices=False)
+        device_input = SimulatedInput()
+        cm.devices[0].input_device = device_input
+        connect_managers(cm, sm)
+
+        sent: dict[tuple[int, int, bool], int] = {}
+        latencies = {True: [], False: []}
+        def sound_handler(sound: SoundEntryManager):
+            x, y = sound.get_xy()
+            playing = sound.is_playing()
+            start = sent.pop((x, y, playing), None)
+            if start is not None:
+                latencies[playing].append(time.perf_counter_ns() - start)
+        sm.set_change_handler(sound_handler)
+
+        def send_burst(status: int, playing: bool):
+            now = time.perf_counter_ns()
+            for i, (x, y) in enumerate(pads):
+                sent[(x, y, playing)] = now
+            device_input.messages.extend([[status, i, 127, 0], i] for i in range(len(pads)))
+
+        listener = asyncio.create_task(cm.listen())
+        # without the log line of every played file
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(rounds):
+                # the bursts are sent from another thread, like the messages of a real device
+                threading.Thread(target=send_burst, args=(0x90, True)).start()
+                await asyncio.sleep(0.05)
+                threading.Thread(target=send_burst, args=(0x80, False)).start()
+                await asyncio.sleep(0.05)
+        listener.cancel()
+        sm.stop()
+    return latencies
+
+if __name__ == "__main__":
+    """
+    Measure the latency of bursts of key presses and key releases, with the files decoded on every hit and with a SampleStore.
+    """
+    from sample_store import SampleStore
+
+    for backend in [PygameMixer(), SampleStore()]:
+        print(f"{type(backend).__name__}:")
+        latencies = asyncio.run(measure_key_latency(backend))
+        for playing, name in [(True, "Press"), (False, "Release")]:
+            values = sorted(latencies[playing])
+            print(f"{name}: {len(values)} events in bursts of 64, "
+                  f"median {format_quantity(values[len(values) // 2], 'ns', 'ms', 2)}, "
+                  f"99th percentile {format_quantity(values[len(values) * 99 // 100], 'ns', 'ms', 2)}, "
+                  f"max {format_quantity(values[-1], 'ns', 'ms', 2)}")
@@ -0,0 +1,174 @@
+"""A module to find the code which blocks the asyncio event loop, e.g. when the key colors or the sounds are delayed."""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import TextIO
+
+from profiling import format_quantity
+
+DEFAULT_STALL_THRESHOLD = 0.1
+HEARTBEAT_INTERVAL = 0.1
+# the lag histogram has buckets of 0.1 ms, 0.2 ms, 0.4 ms, ..., the last one holds everything above 0.1 ms * 2^22, about 7 min
+LAG_BUCKET_UNIT = 0.0001
+LAG_BUCKETS = 24
+
+class LoopWatchdog:
+    """
+    A class to measure the lag of the asyncio event loop and to print the stack of the loop thread while it is blocked.
+
+    A heartbeat callback is scheduled on the loop in a fixed interval and records how late it runs in a histogram.
+    A monitor thread checks the time of the last heartbeat. If the loop is blocked for longer than the threshold, the
+    monitor captures the stack of the loop thread with sys._current_frames, which shows the blocking code while it is
+    still running. When the loop runs again, the duration of the stall and the lag statistics are printed.
+
+    While the loop runs normally, the watchdog costs one short callback per heartbeat and one wake up of the monitor thread.
+    """
+
+    def __init__(self, name: str = "event loop", threshold: float = DEFAULT_STALL_THRESHOLD, interval: float = HEARTBEAT_INTERVAL, output: TextIO | None = None):
+        """
+        Args:
+            name(str): The name of the loop in the printed reports.
+            threshold(float): The lag in seconds from which on the loop counts as blocked.
+            interval(float): The interval of the heartbeat in seconds.
+            output(TextIO): The stream for the reports, None for sys.stderr.
+
+        """
+        self.name = name
+        self.threshold = threshold
+        self.interval = interval
+        self.output = output
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.loop_thread_id: int | None = None
+        self.handle: asyncio.TimerHandle | None = None
+        self.expected = 0.0
+        # written by the heartbeat, read by the monitor thread
+        self.last_beat = 0.0
+        self.last_stall: tuple[float, float] | None = None
+        self.beats = 0
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.histogram = [0] * LAG_BUCKETS
+        self.stop_event = threading.Event()
+        self.monitor_thread: threading.Thread | None = None
+
+    def start(self):
+        """
+        Start the heartbeat and the monitor thread. Has to be called in the thread of the running event loop.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        now = time.monotonic()
+        self.last_beat = now
+        self.expected = now + self.interval
+        self.handle = self.loop.call_at(self._loop_time(self.expected), self._beat)
+        self.stop_event.clear()
+        self.monitor_thread = threading.Thread(target=self._monitor, name="LoopWatchdog", daemon=True)
+        self.monitor_thread.start()
+
+    def stop(self):
+        """
+        Stop the heartbeat and the monitor thread and print the lag statistics of the session.
+        """
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.stop_event.set()
+        if self.monitor_thread is not None:
+            self.monitor_thread.join()
+            self.monitor_thread = None
+            self._print(f"The {self.name} stopped; {self.get_statistics()}")
+
+    def _loop_time(self, monotonic_time: float) -> float:
+        # the loops of asyncio use time.monotonic, but a custom loop may not
+        return monotonic_time - time.monotonic() + self.loop.time()
+
+    def _beat(self):
+        now = time.monotonic()
+        lag = max(0.0, now - self.expected)
+        self.beats += 1
+        self.histogram[min(LAG_BUCKETS - 1, int(lag / LAG_BUCKET_UNIT).bit_length())] += 1
+        if lag > self.max_lag:
+            self.max_lag = lag
+        if lag >= self.threshold:
+            self.stalls += 1
+            self.last_stall = (now, lag)
+        self.last_beat = now
+        # the next beat is planned from now, so a stall is counted once and not by every missed beat
+        self.expected = now + self.interval
+        self.handle = self.loop.call_at(self._loop_time(self.expected), self._beat)
+
+    def get_lag_percentile(self, fraction: float) -> float:
+        """
+        Returns the upper bound of the histogram bucket which contains the given fraction of the measured lags.
+        """
+        target = fraction * self.beats
+        count = 0
+        for idx, bucket in enumerate(self.histogram):
+            count += bucket
+            if count >= target and count > 0:
+                return LAG_BUCKET_UNIT * (1 << idx)
+        return 0.0
+
+    def get_statistics(self) -> str:
+        return (
+            f"lag median <= {format_quantity(self.get_lag_percentile(0.5), 's', 'ms')}, "
+            f"99th percentile <= {format_quantity(self.get_lag_percentile(0.99), 's', 'ms')}, "
+            f"max {format_quantity(self.max_lag, 's', 'ms')}, "
+            f"{self.stalls} stalls in {self.beats} heartbeats"
+        )
+
+    def _print(self, text: str):
+        output = self.output if self.output is not None else sys.stderr
+        timestamp = time.strftime("%H:%M:%S")
+        print(f"[{timestamp} watchdog] {text}", file=output, flush=True)
+
+    def _monitor(self):
+        # two checks within the threshold, so a stall is noticed while it lasts
+        check_interval = self.threshold / 2
+        captured_beat = None
+        reported_stall = None
+        while not self.stop_event.wait(check_interval):
+            last_beat = self.last_beat
+            blocked = time.monotonic() - last_beat - self.interval
+            if blocked >= self.threshold and captured_beat != last_beat:
+                captured_beat = last_beat
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else "  (not available)\n"
+                self._print(f"The {self.name} is blocked for {format_quantity(blocked, 's', 'ms', 0)}, stack of the loop thread:\n{stack.rstrip()}")
+            last_stall = self.last_stall
+            if last_stall is not None and last_stall is not reported_stall:
+                reported_stall = last_stall
+                self._print(f"The {self.name} ran a heartbeat {format_quantity(last_stall[1], 's', 'ms', 0)} late; {self.get_statistics()}")
+
+if __name__ == "__main__":
+    """Block an event loop with a slow function, to show the report, and measure the cost of the watchdog on an idle loop."""
+    import io
+
+    def slow_file_scan():
+        # stands in for e.g. a synchronous decode or a scan of many files in the loop thread
+        time.sleep(0.3)
+
+    async def demo():
+        watchdog = LoopWatchdog()
+        watchdog.start()
+        await asyncio.sleep(0.2)
+        asyncio.get_running_loop().call_soon(slow_file_scan)
+        await asyncio.sleep(0.5)
+        watchdog.stop()
+
+    async def measure_cost(duration: float = 5.0):
+        for enabled in [False, True]:
+            watchdog = LoopWatchdog(output=io.StringIO())
+            if enabled:
+                watchdog.start()
+            start = time.process_time()
+            await asyncio.sleep(duration)
+            cpu = time.process_time() - start
+            if enabled:
+                watchdog.stop()
+            print(f"Idle loop {'with' if enabled else 'without'} the watchdog: {cpu / duration * 100:.3f} % CPU")
+
+    asyncio.run(demo())
+    asyncio.run(measure_cost())
@@ -1,73 +1,140 @@
 """The main entry point to the tool which combines all the different modules."""
-from asyncio import run, get_event_loop, sleep, create_task, wait, FIRST_COMPLETED
+from asyncio import run, get_event_loop, sleep, create_task, to_thread, wait, wrap_future, FIRST_COMPLETED
+from argparse import ArgumentParser
+from inspect import isawaitable
+import multiprocessing
+import os
+import signal
 
 import controller_config
 import sound_config
-from controller_manager import ControllerManager, Controller_SetVolume, Controller_KeyHit, Controller_MasterStop, Controller_MasterVolume, Controller_SetState, get_midi_device_list
-from sound_manager import SoundManager, SoundEntryManager
-from ui_manager import run_ui, UiManagerRequests, create_async_request_handler
+from loop_watchdog import LoopWatchdog
+from sound_library import SoundLibrary
+from ui_manager import run_ui, UiManagerRequests, UiStateQueue, UiRequestBridge
 
 if __name__ == "__main__":
+    # needed by the engine process in the frozen executable
+    multiprocessing.freeze_support()
+
+    parser = ArgumentParser(description="DM Midi Soundboard")
+    parser.add_argument("--record", metavar="FILE", help="record every midi message to a binary log file, see replay_session.py")
+    parser.add_argument("--osc-port", metavar="PORT", type=int, help="trigger sounds with OSC messages on this UDP port")
+    parser.add_argument("--osc-host", metavar="HOST", default="0.0.0.0", help="the address the OSC server binds to (default: all)")
+    parser.add_argument("--library", metavar="FOLDER", action="append", default=[], help="index the sound files in this folder to search them in the entry editor, can be repeated")
+    parser.add_argument("--autosave-interval", metavar="SECONDS", type=int, default=60, help="write changes of the board to <name>.autosave.yaml in this interval, 0 disables it (default: 60)")
+    parser.add_argument("--engine-process", action="store_true", help="run the sound playback and the midi devices in a separate process, so they are not delayed by the ui")
+    parser.add_argument("--stall-threshold", metavar="MS", type=int, default=100, help="print the stack of the event loop when it is blocked for longer than this, 0 disables it (default: 100)")
+    args = parser.parse_args()
+
     async def loop():
         sc = sound_config.SoundConfig()
-        sm = SoundManager(sc)
-
         cc = controller_config.get_controller_config()
-        cm = ControllerManager(cc)
-
-        def request_handler(request: UiManagerRequests, *args):
-            match request:
-                case UiManagerRequests.GET_SOUND_ERROR_POSITIONS:
-                    return sm.get_xy_for_disabled_sounds()
-                case UiManagerRequests.RELOAD_AFTER_CONFIG_CHANGE:
-                    sm.reload_changed_config()
-                case UiManagerRequests.GET_MIDI_DEVICES:
-                    return get_midi_device_list()
-                case UiManagerRequests.GET_DEVICE_OPEN_STATE:
-                    return cm.is_device_opened_successfully()
-                
+
+        cleanup = []
+        stall_threshold = args.stall_threshold / 1000
+        if stall_threshold > 0:
+            watchdog = LoopWatchdog("main event loop" if args.engine_process else "event loop", stall_threshold)
+            watchdog.start()
+            cleanup.append(watchdog.stop)
+
+        if args.engine_process:
+            from engine_process import EngineProcess
+            engine = EngineProcess(cc, {"record": args.record, "osc_host": args.osc_host, "osc_port": args.osc_port, "stall_threshold": stall_threshold})
+            ui_state_queue = UiStateQueue(engine.state_table)
+            engine.start(sc)
+            cleanup.append(engine.close)
+
+            # the file checks of the ui decode formats without a simple header, e.g. mp3,
+            # which needs a mixer in this process too, but not the sound card of the engine
+            os.environ["SDL_AUDIODRIVER"] = "dummy"
+            from pygame import mixer
+            mixer.init()
+
+            def request_handler(request: UiManagerRequests, *args):
+                if request == UiManagerRequests.RELOAD_AFTER_CONFIG_CHANGE:
+                    return wrap_future(engine.reload(sc))
+                return wrap_future(engine.request(request.name, *args))
+
+            engine_tasks = [create_task(engine.wait())]
+        else:
+            # imported here, the sound manager opens the audio device on import
+            from controller_manager import ControllerManager
+            from engine import connect_managers, create_request_handler, run_ticker
+            from midi_recorder import MidiRecorder
+            from osc_server import OscServer
+            from profiling import RuntimeProfiler
+            from sample_store import SampleStore
+            from sound_manager import SoundManager
+            from sound_trim import SoundTrimmer, TrimCache
+
+            trimmer = SoundTrimmer(TrimCache())
+            cleanup.append(trimmer.shutdown)
+            store = SampleStore()
+            cleanup.append(store.shutdown)
+            sm = SoundManager(sc, trimmer, store)
+            cm = ControllerManager(cc)
+            ui_state_queue = UiStateQueue(sm.state_table)
+
+            if args.record is not None:
+                recorder = MidiRecorder(args.record)
+                cm.set_recorder(recorder)
+                cleanup.append(recorder.close)
+
+            osc_server = None
+            if args.osc_port is not None:
+                osc_server = OscServer(sm.state_table)
+                await osc_server.start(args.osc_host, args.osc_port)
+                cleanup.append(osc_server.close)
+
+            connect_managers(cm, sm, osc_server)
+            engine_request_handler = create_request_handler(cm, sm, RuntimeProfiler())
+
+            def request_handler(request: UiManagerRequests, *args):
+                return engine_request_handler(request.name, *args)
+
+            engine_tasks = [create_task(run_ticker(sm)), create_task(cm.listen())]
+
+        if hasattr(signal, "SIGUSR1"):
+            # not available on Windows
+            async def run_signal_request(request: UiManagerRequests):
+                path = request_handler(request)
+                if isawaitable(path):
+                    path = await path
+                print(f"Written to {path}" if path is not None else "Started")
+            def signal_handler(request: UiManagerRequests):
+                create_task(run_signal_request(request))
+            get_event_loop().add_signal_handler(signal.SIGUSR1, signal_handler, UiManagerRequests.TOGGLE_PROFILING)
+            get_event_loop().add_signal_handler(signal.SIGUSR2, signal_handler, UiManagerRequests.TOGGLE_TRACING)
+
+        library = None
+        if len(args.library) > 0:
+            library = SoundLibrary()
+            async def scan_library():
+                analysed, removed = await to_thread(library.scan, args.library)
+                print(f"Sound library: {analysed} files analysed, {removed} removed, {library.get_count()} indexed")
+            library_task = create_task(scan_library())
+            cleanup.append(library_task.cancel)
+
         ui_thread = run_ui(
             sc, 
             dimensions=[8, 8], 
-            request_handler=create_async_request_handler(get_event_loop(), request_handler),
+            request_bridge=UiRequestBridge(get_event_loop(), request_handler),
+            state_queue=ui_state_queue,
+            library=library,
+            autosave_interval=args.autosave_interval,
         )
 
         async def ui_waiter():
             while ui_thread.is_alive():
                 await sleep(0.5)
-            
-
-        async def ticker():
-            while True:
-                sm.tick()
-                await sleep(0.1)
-
-        def midi_handler(event):
-            match event:
-                case Controller_KeyHit(x, y):
-                    sm.hit_note(x, y)
-                case Controller_MasterStop():
-                    sm.stop()
-                case Controller_SetVolume(x, v_int):
-                    sm.set_volume(x, v_int / 127.0)
-                case Controller_MasterVolume(v_int):
-                    sm.set_master_volume(v_int / 127.0)
-        cm.set_event_handler(midi_handler)
-        
-        def sound_handler(sound: SoundEntryManager):
-            x, y = sound.get_xy()
-            state = sound.get_state()
-            cm.set_state(
-                Controller_SetState(x, y, state)
-            )
-        sm.set_change_handler(sound_handler)
 
         try:
-            ticker_task = create_task(ticker())
-            listener_task = create_task(cm.listen())
             ui_task = create_task(ui_waiter())
-            await wait([ticker_task, listener_task, ui_task], return_when=FIRST_COMPLETED)
+            await wait([*engine_tasks, ui_task], return_when=FIRST_COMPLETED)
         except KeyboardInterrupt:
             pass
+        finally:
+            for close in cleanup:
+                close()
 
     run(loop())
\ No newline at end of file
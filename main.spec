@@ -5,7 +5,7 @@ a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[('controller_config.yaml', '.')],
+    datas=[('controller_config.yaml', '.'), ('overview.html.template', '.')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
@@ -0,0 +1,60 @@
+"""A module to record raw midi messages to a compact binary log file and to read them back."""
+import struct
+
+LOG_MAGIC = b"DMMIDI\x00\x01"
+# timestamp in ms, device index, status, data 1, data 2
+LOG_RECORD = struct.Struct("<IBBBB")
+
+class MidiRecorder:
+    """A class to write raw midi messages with their timestamp to a binary log file."""
+
+    def __init__(self, path: str):
+        """
+        Initialize the class and create the log file.
+
+        Args:
+            path(str): The path of the log file. An existing file is overwritten.
+
+        """
+        self.file = open(path, "wb")
+        self.file.write(LOG_MAGIC)
+
+    def write(self, timestamp: int, device_index: int, data: list[int]):
+        """
+        Append one raw midi message to the log file.
+
+        Args:
+            timestamp(int): The midi timestamp of the message in ms.
+            device_index(int): The position of the device in the controller configuration.
+            data(list[int]): The raw midi message, at least the status and two data bytes.
+
+        """
+        self.file.write(LOG_RECORD.pack(timestamp & 0xFFFFFFFF, device_index, data[0], data[1], data[2]))
+
+    def close(self):
+        """
+        Flush and close the log file.
+        """
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def read_midi_log(path: str):
+    """
+    Yield the messages of a log file as tuples of timestamp, device index and raw midi data.
+
+    The raw midi data has the same four element layout as the messages returned by pygame.
+    Raises a ValueError if the file is not a midi log file.
+    """
+    with open(path, "rb") as ifile:
+        if ifile.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError(f"Not a midi log file: {path}")
+        content = ifile.read()
+    usable = len(content) - len(content) % LOG_RECORD.size
+    for ts, device_index, st, d1, d2 in LOG_RECORD.iter_unpack(memoryview(content)[:usable]):
+        yield ts, device_index, [st, d1, d2, 0]
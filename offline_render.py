@@ -0,0 +1,326 @@
+"""
+A script to render a soundboard and a cue script to a WAV file, faster than real time.
+
+The cues run through the normal event handling of the sound manager, so the file selection and the play modes
+are the same as in a live session. Instead of the pygame mixer, the sounds are mixed with numpy in the time of
+the script. The script is a yaml list of the controller events with their time in seconds:
+
+    - {time: 0.0, event: KeyHit, x: 0, y: 0}
+    - {time: 1.5, event: SetVolume, x: 0, data: 64}
+    - {time: 2.0, event: KeyRelease, x: 0, y: 0}
+    - {time: 3.0, event: MasterVolume, data: 100}
+    - {time: 4.0, event: MasterStop}
+"""
+import os
+# must be set before pygame opens the mixer, the mixer is only used to decode the files
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import contextlib
+import hashlib
+import io
+import math
+import random
+import time
+import wave
+from argparse import ArgumentParser
+from dataclasses import dataclass
+
+import numpy as np
+import yaml
+from pygame import mixer, sndarray
+
+import controller_config
+import sound_config
+from controller_manager import ControllerManager, Controller_KeyHit, Controller_KeyRelease, Controller_MasterStop, Controller_MasterVolume, Controller_SetVolume
+from engine import connect_managers
+from sound_config import SoundStorage
+from sound_manager import PygameMixer, SoundManager
+from sound_trim import SoundTrimmer, TrimCache, TrimPoints
+
+TICK_INTERVAL = 0.1
+DEFAULT_MIXER_CHANNELS = 8
+
+SCRIPT_EVENTS = {
+    "KeyHit": Controller_KeyHit,
+    "KeyRelease": Controller_KeyRelease,
+    "SetVolume": Controller_SetVolume,
+    "MasterVolume": Controller_MasterVolume,
+    "MasterStop": Controller_MasterStop,
+}
+
+class OfflineSound:
+    """A decoded sound with the interface of pygame.mixer.Sound, which is played by the OfflineMixer."""
+
+    def __init__(self, backend: "OfflineMixer", samples: np.ndarray):
+        self.backend = backend
+        self.samples = samples
+        self.volume = 1.0
+
+    def set_volume(self, volume: float):
+        self.volume = volume
+
+    def get_volume(self) -> float:
+        return self.volume
+
+    def get_length(self) -> float:
+        return len(self.samples) / self.backend.rate
+
+    def play(self, loops: int = 0) -> "OfflineChannel | None":
+        return self.backend.play(self, loops)
+
+class OfflineChannel:
+    """A channel of the OfflineMixer with the interface of pygame.mixer.Channel."""
+
+    def __init__(self, backend: "OfflineMixer"):
+        self.backend = backend
+        self.sound: OfflineSound | None = None
+        self.pos = 0
+        self.loops = 0
+        self.paused = False
+        self.fade_total = 0
+        self.fade_left: int | None = None
+
+    def start(self, sound: OfflineSound, loops: int):
+        self.sound = sound
+        self.pos = 0
+        self.loops = loops
+        self.paused = False
+        self.fade_left = None
+
+    def stop(self):
+        self.sound = None
+
+    def get_busy(self) -> bool:
+        # like the pygame mixer, a paused channel is busy
+        return self.sound is not None
+
+    def pause(self):
+        self.paused = True
+
+    def unpause(self):
+        self.paused = False
+
+    def fadeout(self, time_ms: int):
+        if self.sound is None:
+            return
+        frames = int(time_ms * self.backend.rate / 1000)
+        if self.paused or frames <= 0:
+            self.stop()
+        elif self.fade_left is None or frames < self.fade_left:
+            self.fade_total = frames
+            self.fade_left = frames
+
+    def mix_into(self, out: np.ndarray):
+        """
+        Add the next frames of the playing sound to the output block.
+        """
+        done = 0
+        while done < len(out) and self.sound is not None and not self.paused:
+            samples = self.sound.samples
+            if len(samples) == 0:
+                self.stop()
+                break
+            take = min(len(out) - done, len(samples) - self.pos)
+            if self.fade_left is not None:
+                take = min(take, self.fade_left)
+            segment = samples[self.pos:self.pos + take]
+            if self.fade_left is None:
+                out[done:done + take] += segment * np.float32(self.sound.volume)
+            else:
+                # a linear fade to silence, like the pygame mixer
+                envelope = (self.fade_left - np.arange(take, dtype=np.float32)) * np.float32(self.sound.volume / self.fade_total)
+                out[done:done + take] += segment * envelope[:, None]
+                self.fade_left -= take
+            self.pos += take
+            done += take
+            if self.fade_left == 0:
+                self.stop()
+            elif self.pos >= len(samples):
+                if self.loops == 0:
+                    self.stop()
+                else:
+                    self.loops = max(-1, self.loops - 1)
+                    self.pos = 0
+
+class OfflineMixer(PygameMixer):
+    """
+    The audio backend of the sound manager for an offline render, which mixes the sounds in blocks with numpy.
+
+    The files are decoded once with the pygame mixer and kept as float samples. Like the pygame mixer, a sound is
+    played on the first free channel and isn't played if all channels are busy. The storage tiers of the entries
+    are ignored.
+    """
+
+    def __init__(self, num_channels: int = DEFAULT_MIXER_CHANNELS):
+        self.rate, sample_format, self.channel_count = mixer.get_init()
+        self.full_scale = float(1 << (abs(sample_format) - 1))
+        self.channels = [OfflineChannel(self) for _ in range(num_channels)]
+        self.decoded: dict[str, np.ndarray] = {}
+        self.position = 0
+
+    def time(self) -> float:
+        """
+        Returns the time of the mixed frames in seconds, the clock of the cues of the sound manager.
+        """
+        return self.position / self.rate
+
+    def load(self, path: str, storage: SoundStorage = SoundStorage.AUTO, trim: TrimPoints | None = None) -> OfflineSound:
+        samples = self.decoded.get(path)
+        if samples is None:
+            samples = sndarray.array(mixer.Sound(path)).astype(np.float32)
+            samples /= self.full_scale
+            if samples.ndim == 1:
+                samples = samples[:, None]
+            self.decoded[path] = samples
+        if trim is not None:
+            # a view, the sound only reads the samples
+            start, end = trim.get_frames(self.rate, len(samples))
+            samples = samples[start:end]
+        return OfflineSound(self, samples)
+
+    def play(self, sound: OfflineSound, loops: int) -> OfflineChannel | None:
+        for channel in self.channels:
+            if not channel.get_busy():
+                channel.start(sound, loops)
+                return channel
+        return None
+
+    def mix(self, frames: int) -> np.ndarray:
+        """
+        Returns the next block of the mix as 16 bit samples, one row per frame.
+        """
+        out = np.zeros((frames, self.channel_count), dtype=np.float32)
+        for channel in self.channels:
+            if channel.sound is not None:
+                channel.mix_into(out)
+        self.position += frames
+        np.clip(out, -1.0, 1.0, out=out)
+        return (out * 32767.0).astype(np.int16)
+
+@dataclass
+class RenderResult:
+    """The statistics of one render."""
+    events: int = 0
+    cues: int = 0
+    frames: int = 0
+    duration: float = 0.0
+    session_duration: float = 0.0
+    digest: str = ""
+
+def load_script(path: str) -> list[tuple[float, object]]:
+    """
+    Returns the events of a cue script with their time in seconds, ordered by the time.
+    """
+    with open(path, "r") as ifile:
+        entries = yaml.safe_load(ifile) or []
+    script = []
+    for entry in entries:
+        entry = dict(entry)
+        t = float(entry.pop("time"))
+        name = entry.pop("event")
+        if name not in SCRIPT_EVENTS:
+            raise ValueError(f"Unknown event '{name}' at {t} s, expected one of: {', '.join(SCRIPT_EVENTS)}")
+        script.append((t, SCRIPT_EVENTS[name](**entry)))
+    # a stable sort keeps the order of events at the same time
+    script.sort(key=lambda e: e[0])
+    return script
+
+def render(script: list[tuple[float, object]], cm: ControllerManager, sm: SoundManager, backend: OfflineMixer, tail: float = 2.0, ofile: wave.Wave_write | None = None) -> RenderResult:
+    """
+    Play the script through the event handler of the controller manager and mix the result.
+
+    The managers have to be connected already and the sound manager has to use the backend and its time as the
+    clock. The sound manager is ticked in the interval of the main loop and its cues are triggered when they are
+    due, both measured in the time of the script.
+
+    Args:
+        script(list): The events with their time in seconds, ordered by the time.
+        cm(ControllerManager): The controller manager, whose event handler receives the events.
+        sm(SoundManager): The sound manager which plays the sounds.
+        backend(OfflineMixer): The mixer of the sound manager.
+        tail(float): The time in seconds which is rendered after the last event.
+        ofile(wave.Wave_write): The WAV file to write, None to only mix, e.g. for a benchmark.
+
+    """
+    result = RenderResult()
+    rate = backend.rate
+    end_frame = round(((script[-1][0] if len(script) > 0 else 0.0) + tail) * rate)
+    tick_frames = round(TICK_INTERVAL * rate)
+    hasher = hashlib.blake2b(digest_size=16)
+
+    start = time.perf_counter()
+    pos = 0
+    next_tick = 0
+    idx = 0
+    while pos < end_frame:
+        if pos >= next_tick:
+            sm.tick()
+            next_tick += tick_frames
+        while idx < len(script) and round(script[idx][0] * rate) <= pos:
+            cm.event_handler(script[idx][1])
+            result.events += 1
+            idx += 1
+        result.cues += sm.scheduler.run_due()
+        next_pos = min(end_frame, next_tick)
+        if idx < len(script):
+            next_pos = min(next_pos, round(script[idx][0] * rate))
+        cue_due = sm.scheduler.next_due()
+        if cue_due is not None:
+            next_pos = min(next_pos, math.ceil(cue_due * rate))
+        block = backend.mix(next_pos - pos)
+        hasher.update(block.tobytes())
+        if ofile is not None:
+            ofile.writeframes(block.tobytes())
+        pos = next_pos
+
+    result.duration = time.perf_counter() - start
+    result.frames = end_frame
+    result.session_duration = end_frame / rate
+    result.digest = hasher.hexdigest()
+    return result
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Render a soundboard and a cue script to a WAV file.")
+    parser.add_argument("sound_config", help="the soundboard yaml file")
+    parser.add_argument("script", help="the yaml file with the timed events")
+    parser.add_argument("output", nargs="?", help="the WAV file to write, omitted to only measure the render time")
+    parser.add_argument("--tail", metavar="SECONDS", type=float, default=2.0, help="the time rendered after the last event (default: 2)")
+    parser.add_argument("--channels", metavar="COUNT", type=int, default=DEFAULT_MIXER_CHANNELS, help="the number of mixer channels (default: 8, like pygame)")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the random file selection (default: 0)")
+    parser.add_argument("--no-trim", action="store_true", help="play the files untrimmed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    sc = sound_config.get_sound_config(args.sound_config)
+    trimmer = None
+    if not args.no_trim:
+        # analysed before the render, so the result doesn't depend on the speed of the analysis
+        trimmer = SoundTrimmer(TrimCache())
+        trimmer.preprocess(sc).result()
+
+    backend = OfflineMixer(args.channels)
+    sm = SoundManager(sc, trimmer, backend, backend.time)
+    cm = ControllerManager(controller_config.ControllerConfig(devices=[]), open_devices=False)
+    connect_managers(cm, sm)
+    script = load_script(args.script)
+
+    with contextlib.ExitStack() as stack:
+        ofile = None
+        if args.output is not None:
+            ofile = stack.enter_context(wave.open(args.output, "wb"))
+            ofile.setnchannels(backend.channel_count)
+            ofile.setsampwidth(2)
+            ofile.setframerate(backend.rate)
+        # without the log line of every played file
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = render(script, cm, sm, backend, args.tail, ofile)
+
+    if trimmer is not None:
+        trimmer.shutdown()
+
+    print(f"Events: {result.events}, cues: {result.cues}")
+    print(f"Session duration: {result.session_duration:.1f} s")
+    print(f"Render duration: {result.duration:.3f} s")
+    if result.duration > 0:
+        print(f"Speed: {result.session_duration / result.duration:.0f}x real time")
+    print(f"Digest: {result.digest}")
@@ -0,0 +1,414 @@
+"""A module to trigger sounds with OSC messages over UDP, e.g. from a tablet or a lighting console in the local network."""
+import asyncio
+import math
+import select
+import socket
+import struct
+import threading
+import time
+import traceback
+
+from controller_manager import Controller_KeyHit, Controller_KeyRelease, Controller_MasterStop, Controller_MasterVolume, Controller_SetVolume, Controller_SetState
+from sound_state_table import SoundStateTable
+
+ADDRESS_HIT = b"/pad/hit"
+ADDRESS_RELEASE = b"/pad/release"
+ADDRESS_VOLUME = b"/volume"
+ADDRESS_MASTER_VOLUME = b"/master/volume"
+ADDRESS_MASTER_STOP = b"/master/stop"
+ADDRESS_SUBSCRIBE = b"/subscribe"
+ADDRESS_UNSUBSCRIBE = b"/unsubscribe"
+ADDRESS_STATE = b"/pad/state"
+
+BUNDLE_HEADER = b"#bundle\0"
+BUNDLE_ELEMENT_SIZE = struct.Struct(">i")
+# the header and the time tag of a bundle
+BUNDLE_HEADER_SIZE = 16
+# bundles nested deeper than this are dropped
+MAX_BUNDLE_DEPTH = 8
+RECEIVE_BUFFER_SIZE = 1 << 20
+
+def _padded(data: bytes) -> bytes:
+    """
+    Returns an OSC string: the data terminated by a null byte and padded to a multiple of four bytes.
+    """
+    return data + b"\0" * (4 - len(data) % 4)
+
+def _padded_length(length: int) -> int:
+    """
+    Returns the size of an OSC string with the given length without the terminating null byte.
+    """
+    return (length + 4) & ~3
+
+class OscEncoder:
+    """A class to encode OSC messages, with the message header and the argument layout built once per address and types."""
+
+    def __init__(self):
+        self.layouts: dict[tuple[bytes, str], tuple[bytes, struct.Struct]] = {}
+
+    def encode(self, address: bytes, types: str, *args) -> bytes:
+        """
+        Returns the OSC message for the address.
+
+        Args:
+            address(bytes): The OSC address of the message.
+            types(str): The type tags of the arguments, 'i' for int32 and 'f' for float32.
+            args: The values of the arguments.
+
+        """
+        layout = self.layouts.get((address, types))
+        if layout is None:
+            layout = (
+                _padded(address) + _padded(b"," + types.encode()),
+                struct.Struct(">" + types)
+            )
+            self.layouts[(address, types)] = layout
+        header, arg_struct = layout
+        return header + arg_struct.pack(*args)
+
+class OscServer:
+    """
+    A UDP server which maps OSC messages to the events of the midi devices.
+
+    The socket is read by a thread into one preallocated buffer. All messages of a burst are parsed
+    there and handed to the event loop as one batch, so the event handler is always called in the
+    thread of the event loop.
+
+    Supported messages:
+        /pad/hit x y          -> Controller_KeyHit
+        /pad/release x y      -> Controller_KeyRelease
+        /volume x value       -> Controller_SetVolume, value as int 0..127 or float 0.0..1.0
+        /master/volume value  -> Controller_MasterVolume, value as int 0..127 or float 0.0..1.0
+        /master/stop          -> Controller_MasterStop
+        /subscribe            -> the sender receives /pad/state x y playing paused for all known positions
+                                 and then for every state change
+        /unsubscribe
+    """
+
+    def __init__(self, state_table: SoundStateTable | None = None):
+        """
+        Args:
+            state_table(SoundStateTable): The states which are sent to new subscribers, e.g. the state_table of the
+                sound manager. None for an empty table.
+
+        """
+        self.sock: socket.socket | None = None
+        self.event_loop: asyncio.AbstractEventLoop | None = None
+        self.receive_thread: threading.Thread | None = None
+        self.event_handler = None
+        self.subscribers: set[tuple] = set()
+        self.state_table = state_table if state_table is not None else SoundStateTable()
+        self.encoder = OscEncoder()
+        # the argument layouts by the type tag string, compiled on first use
+        self.arg_structs: dict[bytes, struct.Struct | None] = {}
+        # matched by the padded address, so no address string is created per message
+        self.handlers = [
+            (_padded(ADDRESS_HIT), self._on_hit),
+            (_padded(ADDRESS_RELEASE), self._on_release),
+            (_padded(ADDRESS_VOLUME), self._on_volume),
+            (_padded(ADDRESS_MASTER_VOLUME), self._on_master_volume),
+            (_padded(ADDRESS_MASTER_STOP), self._on_master_stop),
+            (_padded(ADDRESS_SUBSCRIBE), self._on_subscribe),
+            (_padded(ADDRESS_UNSUBSCRIBE), self._on_unsubscribe),
+        ]
+
+    async def start(self, host: str = "0.0.0.0", port: int = 9000):
+        """
+        Open the UDP socket and start to receive messages.
+
+        Args:
+            host(str): The address to bind to.
+            port(int): The UDP port to bind to, 0 for a free port.
+
+        """
+        self.event_loop = asyncio.get_running_loop()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # a large buffer to survive bursts of messages
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+        self.sock.bind((host, port))
+        # wake up regularly to notice a closed server
+        self.sock.settimeout(0.5)
+        self.receive_thread = threading.Thread(target=self._receive_loop, args=(self.sock,), daemon=True)
+        self.receive_thread.start()
+
+    def get_address(self) -> tuple:
+        """
+        Returns the address the server is bound to.
+        """
+        return self.sock.getsockname()
+
+    def close(self):
+        """
+        Close the UDP socket and stop the receiving thread.
+        """
+        if self.sock is None:
+            return
+        sock = self.sock
+        self.sock = None
+        self.receive_thread.join()
+        sock.close()
+
+    def set_event_handler(self, handler = None):
+        """
+        Set the event handler to call for new events.
+
+        Args:
+            handler: A callable which is called with an object of the event type.
+        
+        """
+        self.event_handler = handler
+
+    def _call_event(self, data: object):
+        """
+        Call the event handler if set.
+        
+        Args:
+            data: The arguments to pass to the handler.
+
+        """
+        if self.event_handler is not None:
+            self.event_handler(data)
+
+    def set_state(self, state: Controller_SetState):
+        """
+        Sends the new state of a position to all subscribed clients.
+        """
+        if self.sock is None or len(self.subscribers) == 0:
+            return
+        message = self._encode_state(state.x, state.y, state.state)
+        for addr in self.subscribers:
+            self._send(message, addr)
+
+    def _encode_state(self, x: int, y: int, state) -> bytes:
+        return self.encoder.encode(ADDRESS_STATE, "iiii", x, y, int(state.playing), int(state.paused))
+
+    def _send(self, message: bytes, addr):
+        try:
+            self.sock.sendto(message, addr)
+        except OSError:
+            pass
+
+    def _receive_loop(self, sock: socket.socket):
+        """
+        Receive packets until the server is closed and pass them to the event loop in batches.
+        """
+        buffer = bytearray(RECEIVE_BUFFER_SIZE)
+        while self.sock is sock:
+            try:
+                nbytes, addr = sock.recvfrom_into(buffer)
+            except TimeoutError:
+                continue
+            except OSError:
+                break
+            batch = []
+            self._parse_datagram(buffer, nbytes, addr, batch)
+            # drain everything that arrived in the meantime
+            while select.select([sock], [], [], 0)[0]:
+                try:
+                    nbytes, addr = sock.recvfrom_into(buffer)
+                except OSError:
+                    break
+                self._parse_datagram(buffer, nbytes, addr, batch)
+            if len(batch) > 0:
+                self.event_loop.call_soon_threadsafe(self._dispatch, batch)
+
+    def _dispatch(self, batch: list):
+        for handler, args, addr in batch:
+            # a failing message must not drop the rest of the batch
+            try:
+                handler(args, addr)
+            except Exception:
+                print(f"The OSC message {handler.__name__}{args} from {addr} failed:")
+                traceback.print_exc()
+
+    def _parse_datagram(self, buffer: bytearray, nbytes: int, addr, batch: list):
+        """
+        Parse a received datagram. A malformed datagram is dropped, it must never stop the receiving thread.
+        """
+        try:
+            self._parse_packet(buffer, 0, nbytes, addr, batch, 0)
+        except RecursionError:
+            pass # nested deeper than the stack, which MAX_BUNDLE_DEPTH should prevent
+
+    def _parse_packet(self, buffer: bytearray, start: int, end: int, addr, batch: list, depth: int):
+        """
+        Parse one OSC packet, which is either a message or a bundle of packets, and append the messages to the batch.
+        A message with invalid arguments is skipped. A bundle with an invalid element size is dropped from that element on.
+        """
+        try:
+            if buffer.startswith(BUNDLE_HEADER, start, end):
+                if depth >= MAX_BUNDLE_DEPTH:
+                    return
+                # skip the header and the time tag, bundled messages are handled at once
+                pos = start + BUNDLE_HEADER_SIZE
+                while pos + BUNDLE_ELEMENT_SIZE.size <= end:
+                    (size,) = BUNDLE_ELEMENT_SIZE.unpack_from(buffer, pos)
+                    pos += BUNDLE_ELEMENT_SIZE.size
+                    # the size is signed, a negative size would move back and parse the same bytes forever
+                    if size <= 0 or pos + size > end:
+                        return
+                    self._parse_packet(buffer, pos, pos + size, addr, batch, depth + 1)
+                    pos += size
+                return
+
+            for padded_address, handler in self.handlers:
+                if buffer.startswith(padded_address, start, end):
+                    break
+            else:
+                return
+            pos = start + len(padded_address)
+            args = ()
+            if pos < end and buffer[pos] == 0x2C: # ','
+                tag_end = buffer.index(b"\0", pos, end)
+                if tag_end > pos + 1:
+                    arg_struct = self._get_arg_struct(bytes(buffer[pos + 1:tag_end]))
+                    if arg_struct is None or start + _padded_length(tag_end - start) + arg_struct.size > end:
+                        return
+                    args = arg_struct.unpack_from(buffer, start + _padded_length(tag_end - start))
+                    # NaN and infinity can't be converted to a pad or a volume, only this message is skipped
+                    if b"f" in buffer[pos + 1:tag_end] and not all(map(math.isfinite, args)):
+                        return
+            batch.append((handler, args, addr))
+        except (struct.error, ValueError):
+            pass # malformed packet
+
+    def _get_arg_struct(self, tags: bytes) -> struct.Struct | None:
+        """
+        Returns the layout of the arguments for a type tag string or None if a type is not supported.
+        """
+        try:
+            return self.arg_structs[tags]
+        except KeyError:
+            arg_struct = None
+            if all(tag in b"if" for tag in tags):
+                arg_struct = struct.Struct(">" + tags.decode())
+            self.arg_structs[tags] = arg_struct
+            return arg_struct
+
+    @staticmethod
+    def _to_midi_value(value: int | float) -> int:
+        """
+        Returns a midi value 0..127 for an int value 0..127 or a float value 0.0..1.0.
+        """
+        if isinstance(value, float):
+            value = round(value * 127)
+        return min(max(value, 0), 127)
+
+    def _on_hit(self, args, addr):
+        if len(args) == 2:
+            x, y = args
+            self._call_event(Controller_KeyHit(int(x), int(y)))
+
+    def _on_release(self, args, addr):
+        if len(args) == 2:
+            x, y = args
+            self._call_event(Controller_KeyRelease(int(x), int(y)))
+
+    def _on_volume(self, args, addr):
+        if len(args) == 2:
+            x, value = args
+            self._call_event(Controller_SetVolume(int(x), self._to_midi_value(value)))
+
+    def _on_master_volume(self, args, addr):
+        if len(args) == 1:
+            self._call_event(Controller_MasterVolume(self._to_midi_value(args[0])))
+
+    def _on_master_stop(self, args, addr):
+        self._call_event(Controller_MasterStop())
+
+    def _on_subscribe(self, args, addr):
+        self.subscribers.add(addr)
+        _, states = self.state_table.get_changes_since(0)
+        for (x, y), state in states.items():
+            self._send(self._encode_state(x, y, state), addr)
+
+    def _on_unsubscribe(self, args, addr):
+        self.subscribers.discard(addr)
+
+class OscClient(asyncio.DatagramProtocol):
+    """A small OSC client for the server, e.g. for tests and benchmarks on the local machine."""
+
+    def __init__(self):
+        self.transport: asyncio.DatagramTransport | None = None
+        self.encoder = OscEncoder()
+        self.states: asyncio.Queue[tuple[int, int, bool, bool]] = asyncio.Queue()
+
+    async def connect(self, host: str = "127.0.0.1", port: int = 9000):
+        """
+        Open a UDP socket to send messages to the server.
+        """
+        await asyncio.get_running_loop().create_datagram_endpoint(lambda: self, remote_addr=(host, port))
+
+    def close(self):
+        """
+        Close the UDP socket.
+        """
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        header = _padded(ADDRESS_STATE) + _padded(b",iiii")
+        if data.startswith(header):
+            x, y, playing, paused = struct.unpack_from(">iiii", data, len(header))
+            self.states.put_nowait((x, y, bool(playing), bool(paused)))
+
+    def hit(self, x: int, y: int):
+        self.transport.sendto(self.encoder.encode(ADDRESS_HIT, "ii", x, y))
+
+    def release(self, x: int, y: int):
+        self.transport.sendto(self.encoder.encode(ADDRESS_RELEASE, "ii", x, y))
+
+    def set_volume(self, x: int, value: int):
+        self.transport.sendto(self.encoder.encode(ADDRESS_VOLUME, "ii", x, value))
+
+    def set_master_volume(self, value: int):
+        self.transport.sendto(self.encoder.encode(ADDRESS_MASTER_VOLUME, "i", value))
+
+    def master_stop(self):
+        self.transport.sendto(self.encoder.encode(ADDRESS_MASTER_STOP, ""))
+
+    def subscribe(self):
+        self.transport.sendto(self.encoder.encode(ADDRESS_SUBSCRIBE, ""))
+
+    def unsubscribe(self):
+        self.transport.sendto(self.encoder.encode(ADDRESS_UNSUBSCRIBE, ""))
+
+if __name__ == "__main__":
+    """Measure the throughput of the server with bursts of messages from a local client."""
+
+    async def benchmark(count: int = 100000, burst: int = 200):
+        received = 0
+        def handler(event):
+            nonlocal received
+            received += 1
+
+        server = OscServer()
+        server.set_event_handler(handler)
+        await server.start("127.0.0.1", 0)
+        client = OscClient()
+        await client.connect(*server.get_address())
+
+        start = time.perf_counter()
+        sent = 0
+        while sent < count:
+            for _ in range(min(burst, count - sent)):
+                client.hit(sent % 8, (sent // 8) % 8)
+                sent += 1
+            # wait until the burst is handled, lost messages end the wait after a timeout
+            burst_start = time.perf_counter()
+            while received < sent and time.perf_counter() - burst_start < 0.1:
+                await asyncio.sleep(0)
+        duration = time.perf_counter() - start
+
+        print(f"Sent: {count}, received: {received}, lost: {count - received}")
+        print(f"Duration: {duration:.3f} s")
+        print(f"Throughput: {received / duration:.0f} messages/s")
+
+        client.close()
+        server.close()
+
+    asyncio.run(benchmark())
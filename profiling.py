@@ -0,0 +1,200 @@
+"""A module to profile a running session: cProfile, tracemalloc snapshots and spans exported as a Chrome/Perfetto trace."""
+import cProfile
+import collections
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+MAX_SPANS = 1_000_000
+MEMORY_TOP_LINES = 30
+# the size of each unit in seconds or bytes
+UNITS = {"ns": 1e-9, "us": 1e-6, "ms": 1e-3, "s": 1.0, "B": 1, "KiB": 1 << 10, "MiB": 1 << 20}
+
+def format_quantity(value: float, unit: str, display_unit: str, digits: int = 1) -> str:
+    """
+    Returns a duration or a size as text in another unit, e.g. "1.5 us" for 1500 ns.
+
+    Args:
+        value(float): The measured value.
+        unit(str): The unit of the value, a key of UNITS.
+        display_unit(str): The unit of the text, a key of UNITS.
+        digits(int): The number of decimal places.
+
+    """
+    return f"{value * UNITS[unit] / UNITS[display_unit]:.{digits}f} {display_unit}"
+
+class _NoSpan:
+    """The span used while the tracing is disabled, it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NO_SPAN = _NoSpan()
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: dict | None):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        end = time.perf_counter_ns()
+        self.tracer.spans.append((self.name, self.start, end - self.start, threading.get_ident(), self.args))
+        return False
+
+class Tracer:
+    """A class to record timed spans. While disabled, a span costs only one attribute check."""
+
+    def __init__(self, max_spans: int = MAX_SPANS):
+        self.enabled = False
+        # the oldest spans are dropped in very long sessions
+        self.spans: collections.deque = collections.deque(maxlen=max_spans)
+
+    def span(self, name: str, args: dict | None = None):
+        """
+        Returns a context manager which records the time spent in its block.
+
+        The args are built by the caller even while the tracing is disabled. On hot paths, the caller checks
+        tracer.enabled first and uses NO_SPAN otherwise:
+
+            with tracer.span("name", {"x": x}) if tracer.enabled else NO_SPAN:
+
+        Args:
+            name(str): The name shown in the trace viewer.
+            args(dict): Optional values shown with the span.
+
+        """
+        if not self.enabled:
+            return NO_SPAN
+        return _Span(self, name, args)
+
+    def start(self):
+        self.spans.clear()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def export_chrome_trace(self, path: str):
+        """
+        Write the recorded spans to a JSON file in the Chrome trace event format, which can be opened with Perfetto or chrome://tracing.
+        """
+        pid = os.getpid()
+        thread_names = {t.ident: t.name for t in threading.enumerate()}
+        events = []
+        tids = set()
+        for name, start, duration, tid, args in list(self.spans):
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": start / 1000.0,
+                "dur": duration / 1000.0,
+                "pid": pid,
+                "tid": tid,
+            }
+            if args is not None:
+                event["args"] = args
+            events.append(event)
+            tids.add(tid)
+        for tid in tids:
+            events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": thread_names.get(tid, str(tid))},
+            })
+        with open(path, "w") as ofile:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, ofile)
+
+# the tracer used by all modules of the tool
+tracer = Tracer()
+
+class RuntimeProfiler:
+    """
+    A class to switch the profiling of a running session on and off.
+
+    cProfile only profiles the thread it is started in, so the methods have to be called in the thread of the asyncio event loop.
+    """
+
+    def __init__(self, output_dir: str = "."):
+        self.output_dir = output_dir
+        self.profile: cProfile.Profile | None = None
+        self.last_snapshot: tracemalloc.Snapshot | None = None
+
+    def _get_output_path(self, prefix: str, suffix: str) -> str:
+        now = time.time()
+        timestamp = f"{time.strftime('%Y%m%d_%H%M%S', time.localtime(now))}_{int(now * 1000) % 1000:03d}"
+        return os.path.join(self.output_dir, f"{prefix}_{timestamp}{suffix}")
+
+    def is_profiling(self) -> bool:
+        return self.profile is not None
+
+    def toggle_profiling(self) -> str | None:
+        """
+        Start cProfile or stop it and write the statistics. Returns the path of the written file, None if it was started.
+        """
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            return None
+        self.profile.disable()
+        path = self._get_output_path("profile", ".prof")
+        self.profile.dump_stats(path)
+        self.profile = None
+        return path
+
+    def toggle_tracing(self) -> str | None:
+        """
+        Start recording spans or stop it and write a Chrome trace. Returns the path of the written file, None if it was started.
+        """
+        if not tracer.enabled:
+            tracer.start()
+            return None
+        tracer.stop()
+        path = self._get_output_path("trace", ".json")
+        tracer.export_chrome_trace(path)
+        return path
+
+    def take_memory_snapshot(self, report: str | None = None) -> str | None:
+        """
+        Start tracemalloc or write the largest allocations and the growth since the last snapshot to a text file.
+        Returns the path of the written file, None if tracemalloc was started.
+
+        Args:
+            report(str): An additional report written in front of the allocations, e.g. the memory of the stored samples.
+
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.last_snapshot = None
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        path = self._get_output_path("memory", ".txt")
+        with open(path, "w") as ofile:
+            ofile.write(f"Traced memory: {current / 1024:.1f} KiB, peak: {peak / 1024:.1f} KiB\n\n")
+            if report is not None:
+                ofile.write(f"{report}\n\n")
+            ofile.write(f"Top {MEMORY_TOP_LINES} allocations by line:\n")
+            for stat in snapshot.statistics("lineno")[:MEMORY_TOP_LINES]:
+                ofile.write(f"{stat}\n")
+            if self.last_snapshot is not None:
+                ofile.write(f"\nTop {MEMORY_TOP_LINES} changes since the last snapshot:\n")
+                for stat in snapshot.compare_to(self.last_snapshot, "lineno")[:MEMORY_TOP_LINES]:
+                    ofile.write(f"{stat}\n")
+        self.last_snapshot = snapshot
+        return path
@@ -0,0 +1,168 @@
+"""A script to replay a recorded midi session through the normal event dispatch with a dummy audio driver, e.g. to measure the throughput or to check for regressions."""
+import os
+# must be set before pygame opens the mixer
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import asyncio
+import json
+import math
+import random
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+
+import controller_config
+import sound_config
+from controller_manager import ControllerManager
+from engine import connect_managers
+from midi_recorder import read_midi_log
+from sound_manager import SoundManager, SoundEntryManager
+
+TICK_INTERVAL_MS = 100
+
+@dataclass
+class ReplayResult:
+    """The statistics and the sound state transitions of one replay."""
+    messages: int = 0
+    events: int = 0
+    cues: int = 0
+    duration: float = 0.0
+    session_duration: float = 0.0
+    # (timestamp, x, y, playing, paused)
+    transitions: list[tuple[int, int, int, bool, bool]] = field(default_factory=list)
+
+class ReplayClock:
+    """The time of a replay in seconds since the first recorded message, the clock of the cues of the sound manager."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+async def replay(log_path: str, cm: ControllerManager, sm: SoundManager, clock: ReplayClock, realtime: bool = False) -> ReplayResult:
+    """
+    Feed a recorded midi log through the dispatch of the controller manager.
+
+    The managers have to be connected already and the sound manager has to use clock.time as the clock. The sound
+    manager is ticked in the interval of the main loop and its cues are triggered when they are due, both measured in
+    the time of the recording, so the cues are reproducible in both modes. Transitions caused by finished sounds
+    depend on the audio timing and are only reproducible with the realtime replay.
+
+    Args:
+        log_path(str): The path of the midi log file.
+        cm(ControllerManager): The controller manager to dispatch the messages with.
+        sm(SoundManager): The sound manager which receives the events.
+        clock(ReplayClock): The clock of the sound manager, which is advanced with the recorded timestamps.
+        realtime(bool): If True, the messages are replayed with the recorded timing, otherwise as fast as possible.
+
+    """
+    result = ReplayResult()
+    current_ts = 0
+
+    event_handler = cm.event_handler
+    def counting_event_handler(event):
+        result.events += 1
+        if event_handler is not None:
+            event_handler(event)
+    cm.set_event_handler(counting_event_handler)
+
+    change_handler = sm.change_handler
+    def recording_change_handler(sound: SoundEntryManager):
+        x, y = sound.get_xy()
+        state = sm.state_table.get_state(x, y)
+        result.transitions.append((current_ts, x, y, state.playing, state.paused))
+        if change_handler is not None:
+            change_handler(sound)
+    sm.set_change_handler(recording_change_handler)
+
+    first_ts = None
+    next_tick = 0
+
+    def set_time(ts: int):
+        nonlocal current_ts
+        current_ts = ts
+        clock.now = (ts - first_ts) / 1000.0
+
+    def advance(ts: int):
+        # the ticks and the cues up to the timestamp, in the order they are due
+        nonlocal next_tick
+        while True:
+            cue_due = sm.scheduler.next_due()
+            cue_ts = first_ts + math.ceil(cue_due * 1000) if cue_due is not None else None
+            if next_tick <= ts and (cue_ts is None or next_tick <= cue_ts):
+                set_time(next_tick)
+                sm.tick()
+                next_tick += TICK_INTERVAL_MS
+            elif cue_ts is not None and cue_ts <= ts:
+                set_time(cue_ts)
+                result.cues += sm.scheduler.run_due()
+            else:
+                break
+
+    start = time.perf_counter()
+    try:
+        for ts, device_index, data in read_midi_log(log_path):
+            if first_ts is None:
+                first_ts = ts
+                next_tick = ts
+            advance(ts)
+            if realtime:
+                delay = (ts - first_ts) / 1000.0 - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            set_time(ts)
+            result.cues += sm.scheduler.run_due()
+            cm.dispatch([(ts, cm.devices[device_index], data)])
+            result.messages += 1
+    finally:
+        cm.set_event_handler(event_handler)
+        sm.set_change_handler(change_handler)
+
+    result.duration = time.perf_counter() - start
+    if first_ts is not None:
+        result.session_duration = (current_ts - first_ts) / 1000.0
+    return result
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Replay a midi session recorded with 'main.py --record'.")
+    parser.add_argument("log", help="the midi log file")
+    parser.add_argument("sound_config", help="the soundboard yaml file used in the session")
+    parser.add_argument("--realtime", action="store_true", help="replay with the recorded timing instead of as fast as possible")
+    parser.add_argument("--save-transitions", metavar="FILE", help="write the sound state transitions to a json file")
+    parser.add_argument("--compare", metavar="FILE", help="compare the sound state transitions with a json file of an earlier replay")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the random file selection (default: 0)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    clock = ReplayClock()
+    sm = SoundManager(sound_config.get_sound_config(args.sound_config), clock=clock.time)
+    cm = ControllerManager(controller_config.get_controller_config(), open_devices=False)
+    connect_managers(cm, sm)
+
+    result = asyncio.run(replay(args.log, cm, sm, clock, args.realtime))
+
+    print(f"Messages: {result.messages}")
+    print(f"Events: {result.events}")
+    print(f"Cues: {result.cues}")
+    print(f"State transitions: {len(result.transitions)}")
+    print(f"Session duration: {result.session_duration:.1f} s")
+    print(f"Replay duration: {result.duration:.3f} s")
+    if result.duration > 0:
+        print(f"Throughput: {result.messages / result.duration:.0f} messages/s")
+
+    if args.save_transitions is not None:
+        with open(args.save_transitions, "w") as ofile:
+            json.dump(result.transitions, ofile)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as ifile:
+            expected = [tuple(e) for e in json.load(ifile)]
+        for idx, (a, b) in enumerate(zip(expected, result.transitions)):
+            if a != b:
+                print(f"Mismatch at transition {idx}: expected {a}, got {b}")
+                raise SystemExit(1)
+        if len(expected) != len(result.transitions):
+            print(f"Mismatch in the number of transitions: expected {len(expected)}, got {len(result.transitions)}")
+            raise SystemExit(1)
+        print("Transitions match.")
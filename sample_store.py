@@ -0,0 +1,277 @@
+"""A module to keep the decoded sound files of a board in memory, in storage tiers which trade quality or hit latency for memory."""
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from pygame import mixer, sndarray
+
+import sound_config
+from profiling import format_quantity
+from sound_config import SoundStorage
+from sound_manager import PygameMixer
+from sound_trim import SoundTrimmer, TrimPoints
+
+DEFAULT_STORE_WORKERS = min(4, os.cpu_count() or 1)
+# the reduced rate tier keeps the average of this many frames
+RATE_REDUCTION = 2
+# the compact tiers expand a file to the format of the mixer on every hit, which only takes a few milliseconds
+# for short files. Larger files are decoded on every hit, which needs less memory and time than the expansion.
+# The size is the decoded size, about 12 s of 44.1 kHz stereo.
+EXPAND_MAX_SIZE = 2 << 20
+# the auto tier keeps short effects, where a hit has to be fast, and decodes longer files on every hit
+AUTO_MAX_STORED_SIZE = 2 << 20
+# the memory for all files of the auto tier, the files above it are decoded on every hit
+DEFAULT_AUTO_BUDGET = 128 << 20
+
+@dataclass(slots=True)
+class StoredSample:
+    """
+    A sound file in one storage tier.
+
+    Native samples are the raw buffer of the mixer. Mono and reduced rate samples are arrays with one row per frame and
+    one column per stored channel, which are expanded to the format of the mixer on every hit. Compressed samples are
+    the bytes of the file, which are decoded on every hit. A DECODE_ON_HIT sample marks a file which is too large
+    for its tier or the budget of the auto tier, it has no data.
+    """
+    storage: SoundStorage
+    data: bytes | np.ndarray
+
+    def get_size(self) -> int:
+        if isinstance(self.data, np.ndarray):
+            return self.data.nbytes
+        return len(self.data)
+
+    def to_sound(self, trim: TrimPoints | None = None) -> mixer.Sound:
+        """
+        Returns a new sound, so every hit has its own volume. With trim points only their part is copied.
+        """
+        rate, sample_format, channels = mixer.get_init()
+        match self.storage:
+            case SoundStorage.NATIVE:
+                data = self.data
+                if trim is not None and trim.is_trimmed():
+                    frame_size = channels * abs(sample_format) // 8
+                    start, end = trim.get_frames(rate, len(data) // frame_size)
+                    data = memoryview(data)[start * frame_size:end * frame_size]
+                return mixer.Sound(buffer=data)
+            case SoundStorage.COMPRESSED:
+                sound = mixer.Sound(file=io.BytesIO(self.data))
+                return trim.apply(sound) if trim is not None else sound
+        samples = self.data
+        if trim is not None and trim.is_trimmed():
+            factor = RATE_REDUCTION if self.storage == SoundStorage.REDUCED_RATE else 1
+            start, end = trim.get_frames(rate / factor, len(samples))
+            samples = samples[start:end]
+        if self.storage == SoundStorage.REDUCED_RATE:
+            samples = _expand_rate(samples, RATE_REDUCTION)
+        if channels == 1:
+            return sndarray.make_sound(np.ascontiguousarray(samples[:, 0]))
+        if samples.shape[1] != channels:
+            samples = np.repeat(samples[:, :1], channels, axis=1)
+        return sndarray.make_sound(samples)
+
+def _to_dtype(samples: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    if np.issubdtype(dtype, np.integer):
+        samples = np.rint(samples)
+    return samples.astype(dtype)
+
+def _reduce_rate(samples: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Returns the average of every factor frames, a simple low pass filter against aliasing.
+    """
+    frames = len(samples) // factor * factor
+    blocks = samples[:frames].reshape(-1, factor, samples.shape[1])
+    return _to_dtype(blocks.mean(axis=1, dtype=np.float32), samples.dtype)
+
+def _expand_rate(samples: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Returns the samples at factor times the rate, interpolated linearly between the stored frames.
+    """
+    if len(samples) == 0:
+        return samples
+    # integers are interpolated in int32, which is faster than floats and can't overflow for 16 bit samples
+    work_dtype = np.int32 if np.issubdtype(samples.dtype, np.integer) else samples.dtype
+    values = samples.astype(work_dtype)
+    steps = np.diff(values, axis=0, append=values[-1:])
+    expanded = np.empty((len(samples), factor, samples.shape[1]), dtype=samples.dtype)
+    expanded[:, 0] = samples
+    for k in range(1, factor):
+        if work_dtype == np.int32:
+            expanded[:, k] = values + steps * k // factor
+        else:
+            expanded[:, k] = values + steps * (k / factor)
+    return expanded.reshape(-1, samples.shape[1])
+
+def store_file(path: str, storage: SoundStorage, trimmer: SoundTrimmer | None = None) -> StoredSample:
+    """
+    Read a sound file into a storage tier. Auto stores a file as mono if all its channels are equal, otherwise native.
+    A file which is decoded larger than AUTO_MAX_STORED_SIZE for the auto tier or EXPAND_MAX_SIZE for the mono,
+    reduced rate and compressed tiers isn't stored. Raises an exception if the file can't be read.
+
+    Args:
+        path(str): The sound file.
+        storage(SoundStorage): The storage tier, except DECODE_ON_HIT.
+        trimmer(SoundTrimmer): Finds the silence of the decoded file, so it isn't decoded again for it.
+
+    """
+    sound = mixer.Sound(path)
+    if trimmer is not None:
+        trimmer.analyse_decoded(path, sound)
+    if storage == SoundStorage.NATIVE:
+        return StoredSample(storage, sound.get_raw())
+    decoded_size = sndarray.samples(sound).nbytes
+    max_size = AUTO_MAX_STORED_SIZE if storage == SoundStorage.AUTO else EXPAND_MAX_SIZE
+    if decoded_size > max_size:
+        return StoredSample(SoundStorage.DECODE_ON_HIT, b"")
+    if storage == SoundStorage.COMPRESSED:
+        with open(path, "rb") as ifile:
+            return StoredSample(storage, ifile.read())
+
+    samples = sndarray.array(sound)
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    is_mono = all(np.array_equal(samples[:, 0], samples[:, c]) for c in range(1, samples.shape[1]))
+    if storage == SoundStorage.AUTO:
+        if is_mono and samples.shape[1] > 1:
+            return StoredSample(SoundStorage.MONO, np.ascontiguousarray(samples[:, :1]))
+        return StoredSample(SoundStorage.NATIVE, sound.get_raw())
+    if is_mono:
+        samples = samples[:, :1]
+    elif storage == SoundStorage.MONO:
+        samples = _to_dtype(samples.mean(axis=1, keepdims=True, dtype=np.float32), samples.dtype)
+    if storage == SoundStorage.REDUCED_RATE:
+        samples = _reduce_rate(samples, RATE_REDUCTION)
+    return StoredSample(storage, np.ascontiguousarray(samples))
+
+class SampleStore(PygameMixer):
+    """
+    The audio backend of the sound manager, which keeps the files of a board decoded in memory, so a hit doesn't read
+    and decode the file.
+
+    Every entry selects a storage tier for its files. The files are read in a pool of worker threads. Until a file is
+    stored, and for files which are not stored, it is decoded on every hit like by the plain mixer. Native files are
+    always stored. Mono, reduced rate and compressed files are only stored up to EXPAND_MAX_SIZE decoded, a longer
+    file is demoted to DECODE_ON_HIT, because decoding it is faster than expanding it on every hit. Auto files are
+    stored up to AUTO_MAX_STORED_SIZE and share a memory budget, the files above it are demoted too.
+    """
+
+    def __init__(self, workers: int = DEFAULT_STORE_WORKERS, auto_budget: int = DEFAULT_AUTO_BUDGET):
+        """
+        Args:
+            workers(int): The number of files read at the same time.
+            auto_budget(int): The memory in bytes for all files of the auto tier.
+
+        """
+        self.auto_budget = auto_budget
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="SampleStore")
+        self.samples: dict[tuple[str, SoundStorage], StoredSample] = {}
+        self.needed: set[tuple[str, SoundStorage]] = set()
+        self.pending: set[tuple[str, SoundStorage]] = set()
+        self.lock = threading.Lock()
+
+    def load(self, path: str, storage: SoundStorage = SoundStorage.AUTO, trim: TrimPoints | None = None) -> mixer.Sound:
+        sample = self.samples.get((path, storage))
+        if sample is None or sample.storage == SoundStorage.DECODE_ON_HIT:
+            return super().load(path, storage, trim)
+        return sample.to_sound(trim)
+
+    def preprocess(self, config: sound_config.SoundConfig, trimmer: SoundTrimmer | None = None) -> Future:
+        """
+        Start reading all files of the board, which are not stored yet, and free the files which are not used anymore.
+        The silence of the read files is found from their decoded samples, the trimmer only decodes the other files.
+        Returns a future which is done when all files are stored, with the number of read files.
+        """
+        keys = {
+            (path, entry.storage)
+            for entry in config.sounds if entry.storage != SoundStorage.DECODE_ON_HIT
+            for path in entry.files
+        }
+        with self.lock:
+            self.needed = keys
+            self.samples = {key: sample for key, sample in self.samples.items() if key in keys}
+            keys = [key for key in sorted(keys) if key not in self.samples and key not in self.pending]
+            self.pending.update(keys)
+        if trimmer is not None:
+            # before the files are read, so the trimmer knows which of them it has to analyse
+            trimmer.preprocess(config, {path for path, _ in keys})
+        futures = [self.pool.submit(self._store, *key, trimmer) for key in keys]
+
+        result = Future()
+        if len(futures) == 0:
+            result.set_result(0)
+            return result
+        remaining = len(futures)
+        def done_handler(_):
+            nonlocal remaining
+            with self.lock:
+                remaining -= 1
+                finished = remaining == 0
+            if finished:
+                result.set_result(len(futures))
+        for future in futures:
+            future.add_done_callback(done_handler)
+        return result
+
+    def _store(self, path: str, storage: SoundStorage, trimmer: SoundTrimmer | None):
+        try:
+            sample = store_file(path, storage, trimmer)
+        except Exception:
+            # missing and unreadable files are marked by the sound manager
+            sample = None
+        with self.lock:
+            self.pending.discard((path, storage))
+            # the board may have changed while the file was read
+            if sample is None or (path, storage) not in self.needed:
+                return
+            if storage == SoundStorage.AUTO:
+                auto_size = sum(s.get_size() for (_, st), s in self.samples.items() if st == SoundStorage.AUTO)
+                if auto_size + sample.get_size() > self.auto_budget:
+                    sample = StoredSample(SoundStorage.DECODE_ON_HIT, b"")
+            self.samples[(path, storage)] = sample
+
+    def get_memory_usage(self, path: str, storage: SoundStorage) -> tuple[SoundStorage, int] | None:
+        sample = self.samples.get((path, storage))
+        if sample is None:
+            return None
+        return sample.storage, sample.get_size()
+
+    def get_memory_by_storage(self) -> dict[SoundStorage, int]:
+        result = {}
+        for sample in list(self.samples.values()):
+            result[sample.storage] = result.get(sample.storage, 0) + sample.get_size()
+        return result
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+def format_memory_usage(pads: dict[tuple[int, int], int], tiers: dict[SoundStorage, int]) -> str:
+    """
+    Returns the memory report of SoundManager.get_memory_usage as text.
+    """
+    lines = [f"Stored samples: {format_quantity(sum(tiers.values()), 'B', 'MiB')}"]
+    for storage, size in sorted(tiers.items(), key=lambda e: -e[1]):
+        lines.append(f"  {storage.value}: {format_quantity(size, 'B', 'MiB')}")
+    lines.append("Per pad:")
+    for (x, y), size in sorted(pads.items(), key=lambda e: -e[1]):
+        lines.append(f"  {x}/{y}: {format_quantity(size, 'B', 'MiB', 2)}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    """Store all files of a board with their storage tiers and print the memory per tier and per pad."""
+    import sys
+    import time
+
+    from sound_manager import SoundManager
+
+    config = sound_config.get_sound_config(sys.argv[1])
+    store = SampleStore()
+    start = time.perf_counter()
+    count = store.preprocess(config).result()
+    duration = time.perf_counter() - start
+    sm = SoundManager(config, backend=store)
+    print(format_memory_usage(*sm.get_memory_usage()))
+    print(f"Stored {count} files in {duration:.2f} s with {DEFAULT_STORE_WORKERS} workers")
+    store.shutdown()
@@ -0,0 +1,177 @@
+"""A module with a ring buffer in shared memory, lock-free on x86, to pass messages between two processes."""
+import multiprocessing
+import platform
+import struct
+import sys
+from multiprocessing import shared_memory
+
+DEFAULT_CAPACITY = 1 << 20
+# the write and the read index are in different cache lines, given in units of the 8 byte index
+WRITE_INDEX = 0
+READ_INDEX = 8
+# the capacity is written once by the creator, the size of the shared memory may be rounded up to whole pages
+CAPACITY_INDEX = 4
+DATA_OFFSET = 128
+LENGTH = struct.Struct("<I")
+WRAP_MARKER = 0xFFFFFFFF
+ALIGNMENT = 8
+# x86 CPUs keep the order of the stores of a thread and never move a store before an earlier load, which is all the
+# indexes need. Other CPUs, e.g. ARM, may reorder them, there the indexes are accessed under a lock.
+STRONG_MEMORY_ORDER = platform.machine().lower() in ("x86_64", "amd64", "i386", "i686", "x86")
+
+class SharedRingBuffer:
+    """
+    A single producer, single consumer ring buffer of variable sized messages in shared memory.
+
+    The producer only writes the write index and the consumer only writes the read index, so no lock is needed.
+    Both indexes count the bytes ever written or read. They are accessed through a memoryview of native 8 byte
+    integers, which CPython reads and writes with a single memcpy, so the other process never sees a half written index.
+    (struct with an explicit byte order writes byte by byte.)
+    Messages are stored with a length prefix and padded to 8 bytes. A message which doesn't fit in front of the
+    end of the buffer is written to the start, after a wrap marker. Both sides have to wrap at the same position, so
+    the capacity is stored in the header and not derived from the size of the shared memory, which some platforms
+    report rounded up to whole pages.
+
+    Python has no memory barriers, so the order of the memory accesses is left to the CPU. The producer writes a
+    message before the write index, and the consumer reads a message before the read index. On x86 the other process
+    sees the stores in this order. Other CPUs may reorder them, so there the indexes are read and written under a
+    lock, an interprocess semaphore whose acquire and release synchronize the memory. It is only held for the index
+    access, so it never waits for the other side to handle a message.
+    """
+
+    def __init__(self, name: str | None = None, capacity: int = DEFAULT_CAPACITY, lock = None):
+        """
+        Create a new ring buffer or attach to an existing one.
+
+        Args:
+            name(str): The name of an existing ring buffer, None to create a new one.
+            capacity(int): The size of the message area of a new ring buffer in bytes, a multiple of 8. When
+                attaching, the capacity of the existing ring buffer, which is checked against its header.
+            lock: The lock of an existing ring buffer, see get_attach_args.
+
+        """
+        if name is None:
+            if capacity % ALIGNMENT != 0:
+                raise ValueError("The capacity must be a multiple of 8.")
+            self.shm = shared_memory.SharedMemory(create=True, size=DATA_OFFSET + capacity)
+            self.shm.buf[:DATA_OFFSET] = bytes(DATA_OFFSET)
+            self.owner = True
+            # the other process is started with spawn, a lock of the fork context can't be passed to it
+            lock = None if STRONG_MEMORY_ORDER else multiprocessing.get_context("spawn").Lock()
+        else:
+            self.shm = _attach_shared_memory(name)
+            self.owner = False
+        self.lock = lock
+        self.buf = self.shm.buf
+        self.indexes = self.buf[:DATA_OFFSET].cast("Q")
+        if self.owner:
+            self.indexes[CAPACITY_INDEX] = capacity
+        elif self.indexes[CAPACITY_INDEX] != capacity:
+            stored = self.indexes[CAPACITY_INDEX]
+            self.close()
+            raise ValueError(f"The ring buffer {name} has a capacity of {stored} bytes, not {capacity}.")
+        assert self.shm.size >= DATA_OFFSET + capacity
+        self.capacity = capacity
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def get_attach_args(self) -> tuple:
+        """
+        Returns the arguments to attach to this ring buffer in another process, which is started with them.
+        """
+        return self.name, self.capacity, self.lock
+
+    def _load_index(self, index: int) -> int:
+        if self.lock is None:
+            return self.indexes[index]
+        with self.lock:
+            return self.indexes[index]
+
+    def _store_index(self, index: int, value: int):
+        if self.lock is None:
+            self.indexes[index] = value
+        else:
+            with self.lock:
+                self.indexes[index] = value
+
+    def write(self, message: bytes) -> bool:
+        """
+        Append a message. Returns False if there is not enough free space, then nothing is written.
+        """
+        size = LENGTH.size + len(message)
+        size += -size % ALIGNMENT
+        if size > self.capacity:
+            raise ValueError(f"Message of {len(message)} bytes is too large for the ring buffer.")
+        write_idx = self.indexes[WRITE_INDEX]
+        read_idx = self._load_index(READ_INDEX)
+        pos = write_idx % self.capacity
+        skip = self.capacity - pos if self.capacity - pos < size else 0
+        if write_idx + skip + size - read_idx > self.capacity:
+            return False
+        if skip > 0:
+            LENGTH.pack_into(self.buf, DATA_OFFSET + pos, WRAP_MARKER)
+            pos = 0
+        LENGTH.pack_into(self.buf, DATA_OFFSET + pos, len(message))
+        start = DATA_OFFSET + pos + LENGTH.size
+        self.buf[start:start + len(message)] = message
+        # publish the message after its content is written
+        self._store_index(WRITE_INDEX, write_idx + skip + size)
+        return True
+
+    def read(self) -> bytes | None:
+        """
+        Returns the oldest message and removes it, None if the ring buffer is empty.
+        """
+        read_idx = self.indexes[READ_INDEX]
+        write_idx = self._load_index(WRITE_INDEX)
+        if read_idx == write_idx:
+            return None
+        pos = read_idx % self.capacity
+        (length,) = LENGTH.unpack_from(self.buf, DATA_OFFSET + pos)
+        if length == WRAP_MARKER:
+            read_idx += self.capacity - pos
+            pos = 0
+            (length,) = LENGTH.unpack_from(self.buf, DATA_OFFSET)
+        start = DATA_OFFSET + pos + LENGTH.size
+        message = bytes(self.buf[start:start + length])
+        size = LENGTH.size + length
+        size += -size % ALIGNMENT
+        # free the space after the message is copied
+        self._store_index(READ_INDEX, read_idx + size)
+        return message
+
+    def read_all(self, limit: int = 1024) -> list[bytes]:
+        """
+        Returns up to limit of the oldest messages and removes them.
+        """
+        messages = []
+        while len(messages) < limit:
+            message = self.read()
+            if message is None:
+                break
+            messages.append(message)
+        return messages
+
+    def close(self):
+        """
+        Detach from the shared memory, the creating process also removes it.
+        """
+        self.indexes.release()
+        self.indexes = None
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to shared memory created by another process, which is responsible for removing it.
+
+    Before Python 3.13 the memory is registered with the resource tracker again. This is harmless for
+    processes started by multiprocessing, which share the resource tracker of the creating process.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
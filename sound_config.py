@@ -1,17 +1,46 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 import yaml
 import json
 import enum
+from dataclasses import dataclass
 
 class SoundPlayMode(str, enum.Enum):
     PLAY = 'play_and_layer'
     PLAY_AND_PAUSE = 'play_and_pause'
     PLAY_AND_STOP = 'play_and_stop'
+    GATE = 'play_while_held'
 
 class SoundFileSelect(str, enum.Enum):
     SEQUENCE = 'sequence'
     RANDOM = 'random'
 
+class SoundStorage(str, enum.Enum):
+    AUTO = 'auto'
+    NATIVE = 'native'
+    MONO = 'mono'
+    REDUCED_RATE = 'reduced_rate'
+    COMPRESSED = 'compressed'
+    DECODE_ON_HIT = 'decode_on_hit'
+
+class SoundCueAction(str, enum.Enum):
+    HIT = 'hit'
+    RELEASE = 'release'
+
+@dataclass(slots=True, frozen=True)
+class SoundState:
+    """The playback state of a sound entry."""
+    playing: bool
+    paused: bool
+    mode: SoundPlayMode
+
+class SoundCue(BaseModel):
+    """A key event on another pad, which is triggered after a delay when the sound of an entry is started."""
+
+    x: int
+    y: int
+    delay: float = Field(default=0.0, ge=0.0, description="The delay in seconds after the start of the sound.")
+    action: SoundCueAction = SoundCueAction.HIT
+
 class SoundEntry(BaseModel):
     """The entry to describe one sound effect."""
 
@@ -21,9 +50,48 @@ class SoundEntry(BaseModel):
     files: list[str]
     file_select: SoundFileSelect = SoundFileSelect.SEQUENCE
     mode: SoundPlayMode = SoundPlayMode.PLAY
+    trim_silence: bool = True
+    storage: SoundStorage = SoundStorage.AUTO
+    cues: list[SoundCue] = []
 
 class SoundConfig(BaseModel):
     sounds: list[SoundEntry] = []
+    silence_threshold_db: float = -60.0
+
+    @model_validator(mode="after")
+    def check_cue_cycles(self):
+        """Reject hit cues without a delay which lead back to their entry, they would hit the pads again and again."""
+        targets = {
+            (entry.x, entry.y): [
+                (cue.x, cue.y) for cue in entry.cues
+                if cue.action == SoundCueAction.HIT and cue.delay == 0
+            ]
+            for entry in self.sounds
+        }
+        # a depth first search, every position is finished once
+        finished = set()
+        for start in targets:
+            path = [start]
+            stack = [iter(targets[start])]
+            while len(stack) > 0:
+                position = next(stack[-1], None)
+                if position is None:
+                    finished.add(path.pop())
+                    stack.pop()
+                elif position in path:
+                    cycle = " -> ".join(f"{x}/{y}" for x, y in path[path.index(position):] + [position])
+                    raise ValueError(f"The cues without a delay form a cycle: {cycle}")
+                elif position not in finished and position in targets:
+                    path.append(position)
+                    stack.append(iter(targets[position]))
+        return self
+
+def copy_sound_config(target: SoundConfig, source: SoundConfig):
+    """
+    Copy every field of a configuration into another one, which is shared with the other modules of the tool.
+    """
+    for name in SoundConfig.model_fields:
+        setattr(target, name, getattr(source, name))
 
 def get_sound_config(path: str):
     """
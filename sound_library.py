@@ -0,0 +1,304 @@
+"""A module to index the sound files in a local library with their audio metadata, to search them and to estimate the memory of a soundboard."""
+import hashlib
+import os
+import sqlite3
+import struct
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import sound_config
+
+AUDIO_EXTENSIONS = {".wav", ".ogg", ".flac", ".mp3"}
+DEFAULT_DATABASE = "sound_library.db"
+HASH_CHUNK_SIZE = 1 << 20
+COMMIT_BATCH_SIZE = 200
+# the sample format of the pygame mixer, if it is not initialized
+DEFAULT_MIXER_RATE = 44100
+DEFAULT_MIXER_CHANNELS = 2
+DEFAULT_MIXER_SAMPLE_SIZE = 2
+
+@dataclass
+class SoundFileInfo:
+    """The metadata of one sound file. Audio values are None if the file format couldn't be read."""
+    path: str
+    size: int
+    mtime: float
+    duration: float | None = None
+    sample_rate: int | None = None
+    channels: int | None = None
+    content_hash: str | None = None
+    error: str | None = None
+
+def _read_wav_info(path: str) -> tuple[float, int, int]:
+    with wave.open(path, "rb") as wav:
+        rate = wav.getframerate()
+        return wav.getnframes() / rate, rate, wav.getnchannels()
+
+def _read_flac_info(path: str) -> tuple[float, int, int]:
+    with open(path, "rb") as ifile:
+        header = ifile.read(42)
+    if header[:4] != b"fLaC":
+        raise ValueError("Missing FLAC header")
+    # STREAMINFO: 20 bit sample rate, 3 bit channels - 1, 5 bit bits per sample - 1, 36 bit total samples
+    (packed,) = struct.unpack(">Q", header[18:26])
+    rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    return total_samples / rate, rate, channels
+
+def _read_ogg_info(path: str) -> tuple[float, int, int]:
+    with open(path, "rb") as ifile:
+        header = ifile.read(64)
+        pos = header.find(b"\x01vorbis")
+        if header[:4] != b"OggS" or pos < 0:
+            raise ValueError("Missing Ogg Vorbis header")
+        channels = header[pos + 11]
+        (rate,) = struct.unpack("<I", header[pos + 12:pos + 16])
+        # the granule position of the last page is the number of samples
+        ifile.seek(0, os.SEEK_END)
+        ifile.seek(max(0, ifile.tell() - 65536))
+        tail = ifile.read()
+    last_page = tail.rfind(b"OggS")
+    if last_page < 0:
+        raise ValueError("Missing Ogg page")
+    (granule,) = struct.unpack("<q", tail[last_page + 6:last_page + 14])
+    return granule / rate, rate, channels
+
+def _read_decoded_info(path: str) -> tuple[float, int | None, int | None]:
+    """Fallback for formats without a simple header, e.g. mp3. Decodes the whole file."""
+    from pygame import mixer
+    if mixer.get_init() is None:
+        raise ValueError("Mixer not initialized")
+    return mixer.Sound(path).get_length(), None, None
+
+AUDIO_INFO_READERS = {
+    ".wav": _read_wav_info,
+    ".flac": _read_flac_info,
+    ".ogg": _read_ogg_info,
+}
+
+def read_audio_info(path: str) -> tuple[float, int | None, int | None]:
+    """
+    Returns the duration, sample rate and channels of a sound file. Raises an exception if the file can't be read.
+    """
+    reader = AUDIO_INFO_READERS.get(os.path.splitext(path)[1].lower(), _read_decoded_info)
+    return reader(path)
+
+def find_sound_files(folder: str) -> list[str]:
+    """
+    Returns the sound files in the folder and its sub folders, sorted by the path.
+    """
+    found: dict[str, tuple[int, float]] = {}
+    _find_files(folder, found)
+    return sorted(found)
+
+def _find_files(folder: str, found: dict[str, tuple[int, float]]):
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                _find_files(entry.path, found)
+            elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                stat = entry.stat()
+                found[entry.path] = (stat.st_size, stat.st_mtime)
+        except OSError:
+            pass
+
+def analyse_file(path: str, size: int, mtime: float) -> SoundFileInfo:
+    """
+    Returns the metadata of a sound file. Errors are stored in the result.
+    """
+    info = SoundFileInfo(path=path, size=size, mtime=mtime)
+    try:
+        hasher = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as ifile:
+            while chunk := ifile.read(HASH_CHUNK_SIZE):
+                hasher.update(chunk)
+        info.content_hash = hasher.hexdigest()
+
+        info.duration, info.sample_rate, info.channels = read_audio_info(path)
+    except Exception as e:
+        info.error = str(e)
+    return info
+
+def get_decoded_size(duration: float | None) -> int:
+    """
+    Returns the memory in bytes of a sound decoded by the pygame mixer, 0 if the duration is unknown.
+    """
+    if duration is None:
+        return 0
+    rate, channels, sample_size = DEFAULT_MIXER_RATE, DEFAULT_MIXER_CHANNELS, DEFAULT_MIXER_SAMPLE_SIZE
+    try:
+        from pygame import mixer
+        init = mixer.get_init()
+        if init is not None:
+            rate, sample_format, channels = init
+            sample_size = abs(sample_format) // 8
+    except ImportError:
+        pass
+    return int(duration * rate) * channels * sample_size
+
+class SoundLibrary:
+    """
+    A class to index sound files in a SQLite database.
+
+    Every thread uses its own database connection, so the library can be used by the UI and the engine at the same time.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DATABASE):
+        self.db_path = db_path
+        self.local = threading.local()
+        with self._connection() as con:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    duration REAL,
+                    sample_rate INTEGER,
+                    channels INTEGER,
+                    content_hash TEXT,
+                    error TEXT
+                )
+            """)
+            con.execute("CREATE INDEX IF NOT EXISTS files_content_hash ON files(content_hash)")
+
+    def _connection(self) -> sqlite3.Connection:
+        con = getattr(self.local, "connection", None)
+        if con is None:
+            con = sqlite3.connect(self.db_path, timeout=10)
+            con.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = con
+        return con
+
+    def scan(self, folders: list[str], workers: int | None = None) -> tuple[int, int]:
+        """
+        Index all sound files in the folders and their sub folders.
+
+        Only new files and files with a changed size or modification time are analysed, in a pool of worker threads.
+        Files which don't exist anymore are removed from the index.
+
+        Returns the number of analysed and removed files.
+        """
+        found: dict[str, tuple[int, float]] = {}
+        for folder in folders:
+            _find_files(os.path.abspath(folder), found)
+
+        con = self._connection()
+        known: dict[str, tuple[int, float]] = {}
+        for folder in folders:
+            prefix = os.path.join(os.path.abspath(folder), "")
+            for path, size, mtime in con.execute(
+                "SELECT path, size, mtime FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)
+            ):
+                known[path] = (size, mtime)
+
+        removed = [(path,) for path in known if path not in found]
+        changed = [(path, size, mtime) for path, (size, mtime) in found.items() if known.get(path) != (size, mtime)]
+
+        with con:
+            con.executemany("DELETE FROM files WHERE path = ?", removed)
+
+        batch = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for info in pool.map(lambda e: analyse_file(*e), changed):
+                batch.append(info)
+                if len(batch) >= COMMIT_BATCH_SIZE:
+                    self._store(batch)
+                    batch.clear()
+        self._store(batch)
+        return len(changed), len(removed)
+
+    def _store(self, infos: list[SoundFileInfo]):
+        if len(infos) == 0:
+            return
+        with self._connection() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (i.path, i.size, i.mtime, i.duration, i.sample_rate, i.channels, i.content_hash, i.error)
+                    for i in infos
+                ]
+            )
+
+    def get_info(self, path: str) -> SoundFileInfo | None:
+        """
+        Returns the indexed metadata of a file, relative paths are resolved from the working directory.
+        """
+        row = self._connection().execute(
+            "SELECT * FROM files WHERE path = ?", (os.path.abspath(path),)
+        ).fetchone()
+        if row is None:
+            return None
+        return SoundFileInfo(*row)
+
+    def search(self, query: str, limit: int = 200) -> list[SoundFileInfo]:
+        """
+        Returns the indexed files whose path contains all words of the query, ignoring the case.
+        """
+        conditions = []
+        params = []
+        for word in query.split():
+            conditions.append("path LIKE ? ESCAPE '\\'")
+            escaped = word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+        where = " AND ".join(conditions) if len(conditions) > 0 else "1"
+        rows = self._connection().execute(
+            f"SELECT * FROM files WHERE {where} AND error IS NULL ORDER BY path LIMIT ?", (*params, limit)
+        ).fetchall()
+        return [SoundFileInfo(*row) for row in rows]
+
+    def get_count(self) -> int:
+        """
+        Returns the number of indexed files.
+        """
+        return self._connection().execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def estimate_entry_memory(self, entry: sound_config.SoundEntry) -> tuple[int, int]:
+        """
+        Returns the decoded size in bytes of the largest file of an entry and the number of files which are not indexed.
+        """
+        largest = 0
+        unknown = 0
+        for path in entry.files:
+            info = self.get_info(path)
+            if info is None or info.duration is None:
+                unknown += 1
+            else:
+                largest = max(largest, get_decoded_size(info.duration))
+        return largest, unknown
+
+    def estimate_board_memory(self, config: sound_config.SoundConfig) -> tuple[int, int]:
+        """
+        Returns the decoded size in bytes if every entry of the board plays its largest file and the number of files which are not indexed.
+        """
+        total = 0
+        unknown = 0
+        for entry in config.sounds:
+            size, entry_unknown = self.estimate_entry_memory(entry)
+            total += size
+            unknown += entry_unknown
+        return total, unknown
+
+if __name__ == "__main__":
+    """Index the given folders and print the size of the library."""
+    import sys
+    import time
+
+    from pygame import mixer
+    try:
+        # needed to read formats without a simple header, e.g. mp3
+        mixer.init()
+    except Exception:
+        pass
+
+    library = SoundLibrary()
+    start = time.perf_counter()
+    analysed, removed = library.scan(sys.argv[1:])
+    print(f"Analysed: {analysed}, removed: {removed}, indexed: {library.get_count()}")
+    print(f"Duration: {time.perf_counter() - start:.2f} s")
@@ -1,20 +1,63 @@
 import sound_config
+from sound_config import SoundState, SoundStorage
+from sound_state_table import SoundStateTable
+from sound_trim import SoundTrimmer, TrimPoints
+from cue_scheduler import CueScheduler
+from concurrent.futures import Future
 from pygame import mixer
 from random import randint
-from dataclasses import dataclass
+from typing import Callable
 import os
+from profiling import NO_SPAN, tracer
 
 mixer.init()
 
-@dataclass
-class SoundState:
-    playing: bool
-    paused: bool
-    mode: sound_config.SoundPlayMode
+STOP_FADE_OUT_MS = 200
+# short, so a released key sounds immediate, but long enough to avoid a click
+GATE_FADE_OUT_MS = 50
+
+class PygameMixer:
+    """The audio backend of the sound manager, which plays the sounds with the pygame mixer and decodes the files on every hit."""
+
+    def load(self, path: str, storage: SoundStorage = SoundStorage.AUTO, trim: TrimPoints | None = None) -> mixer.Sound:
+        """
+        Returns a new sound of a file, only the part between the trim points if they are given.
+        """
+        sound = mixer.Sound(path)
+        if trim is not None:
+            sound = trim.apply(sound)
+        return sound
+
+    def preprocess(self, config: sound_config.SoundConfig, trimmer: SoundTrimmer | None = None) -> Future:
+        """
+        Prepare the files of a changed board and start the analysis of their silence. Returns a future which is done
+        when all files are prepared, with the number of prepared files, here at once with 0.
+
+        Args:
+            config(SoundConfig): The changed board.
+            trimmer(SoundTrimmer): Finds the silence of the files in the background, None if the files are not trimmed.
+
+        """
+        if trimmer is not None:
+            trimmer.preprocess(config)
+        result = Future()
+        result.set_result(0)
+        return result
+
+    def get_memory_usage(self, path: str, storage: SoundStorage) -> tuple[SoundStorage, int] | None:
+        """
+        Returns the storage tier and the size in bytes of a stored file, None if it isn't stored.
+        """
+        return None
+
+    def get_memory_by_storage(self) -> dict[SoundStorage, int]:
+        return {}
 
 class SoundEntryManager:
-    def __init__(self, config_ref: sound_config.SoundEntry):
+    def __init__(self, config_ref: sound_config.SoundEntry, trimmer: SoundTrimmer | None = None, backend: PygameMixer | None = None):
         self.config_ref = config_ref
+        self.trimmer = trimmer
+        self.backend = backend if backend is not None else PygameMixer()
         self.sound_list: list[str] = self.config_ref.files
         self.enabled = True
         for sound in self.sound_list:
@@ -34,22 +77,36 @@ class SoundEntryManager:
     def is_enabled(self) -> bool:
         return self.enabled
     
-    def hit(self):
+    def hit(self) -> bool:
+        """
+        Handle a key hit according to the play mode. Returns True if a sound was started.
+        """
         if not self.is_enabled():
-            return
+            return False
         match self.config_ref.mode:
             case sound_config.SoundPlayMode.PLAY:
                 self.play_sound()
             case sound_config.SoundPlayMode.PLAY_AND_PAUSE:
                 if self.is_playing():
                     self.toggle_pause()
-                else:
-                    self.play_sound()
+                    return False
+                self.play_sound()
             case sound_config.SoundPlayMode.PLAY_AND_STOP:
                 if self.is_playing():
                     self.stop()
-                else:
-                    self.play_sound()
+                    return False
+                self.play_sound()
+            case sound_config.SoundPlayMode.GATE:
+                self.play_sound()
+        return True
+
+    def release(self):
+        if not self.is_enabled():
+            return
+        if self.config_ref.mode == sound_config.SoundPlayMode.GATE:
+            for channel in self.playing_channels:
+                channel.fadeout(GATE_FADE_OUT_MS)
+            self.playing_channels.clear()
 
     def get_next_sound_obj(self) -> mixer.Sound:
         if not self.is_enabled():
@@ -61,7 +118,12 @@ class SoundEntryManager:
                 self.sound_obj_play_idx = randint(0, len(self.sound_list)-1)
         sound_path = self.sound_list[self.sound_obj_play_idx]
         print(f"Playing: {sound_path}")
-        sound = mixer.Sound(sound_path)
+        with tracer.span("mixer.Sound", {"file": sound_path}) if tracer.enabled else NO_SPAN:
+            trim = None
+            if self.trimmer is not None and self.config_ref.trim_silence:
+                # files which are not analysed yet are played untrimmed
+                trim = self.trimmer.get_trim(sound_path)
+            sound = self.backend.load(sound_path, self.config_ref.storage, trim)
         sound.set_volume(self.volume)
         self.current_sound = sound
         return sound
@@ -96,22 +158,31 @@ class SoundEntryManager:
             case sound_config.SoundPlayMode.PLAY_AND_STOP:
                 if not self.playing_channels[0].get_busy():
                     self.play_sound()
+            case sound_config.SoundPlayMode.GATE:
+                # the sound loops until the key is released, unless its channel was taken by another sound
+                if not self.playing_channels[0].get_busy():
+                    self.playing_channels.clear()
+                    return True
         return False
 
     def play_sound(self):
         if not self.is_enabled():
             return
         sound = self.get_next_sound_obj()
-        if self.config_ref.mode in [sound_config.SoundPlayMode.PLAY_AND_PAUSE, sound_config.SoundPlayMode.PLAY_AND_STOP]:
+        if self.config_ref.mode in [sound_config.SoundPlayMode.PLAY_AND_PAUSE, sound_config.SoundPlayMode.PLAY_AND_STOP, sound_config.SoundPlayMode.GATE]:
             self.stop()
-        self.playing_channels.append(sound.play())
+        loops = -1 if self.config_ref.mode == sound_config.SoundPlayMode.GATE else 0
+        channel = sound.play(loops=loops)
+        if channel is not None:
+            # None if all mixer channels are busy
+            self.playing_channels.append(channel)
         self.playing_channel_paused = False
 
     def stop(self):
         if not self.is_enabled():
             return
         for channel in self.playing_channels:
-            channel.fadeout(200)
+            channel.fadeout(STOP_FADE_OUT_MS)
         self.playing_channels.clear()
 
     def pause(self):
@@ -148,19 +219,36 @@ class SoundEntryManager:
 
 
 class SoundManager:
-    def __init__(self, config_ref: sound_config.SoundConfig):
+    def __init__(self, config_ref: sound_config.SoundConfig, trimmer: SoundTrimmer | None = None, backend: PygameMixer | None = None, clock: Callable[[], float] | None = None):
+        """
+        Args:
+            config_ref(sound_config.SoundConfig): The soundboard.
+            trimmer(SoundTrimmer): Finds the silence of the files in the background, None to play the files untrimmed.
+            backend(PygameMixer): Decodes and plays the sounds, None for the pygame mixer, e.g. a sample_store.SampleStore.
+            clock(Callable): The time of the cues, None for the time of the running event loop. With a clock,
+                the owner triggers the due cues with scheduler.run_due.
+
+        """
         self.config_ref = config_ref
+        self.trimmer = trimmer
+        self.backend = backend if backend is not None else PygameMixer()
+        self.scheduler = CueScheduler(self._trigger_cue, clock)
         self.sounds: dict[int, dict[int, SoundEntryManager]] = {}
         self.volumes: dict[int, float] = {}
         self.master_volume = 1.0
+        self.change_handler = None
+        self.state_table = SoundStateTable()
 
         self.reload_changed_config()
 
-        self.change_handler = None
-
     def reload_changed_config(self):
+        # the pending cues belong to the old entries
+        self.scheduler.cancel_all()
         for sound in self.iterate_sounds():
             sound.stop()
+            self._call_handler(sound)
+        for col in self.sounds.values():
+            col.clear()
 
         def get_x(x: int) -> dict[int, SoundEntryManager]:
             if x not in self.sounds:
@@ -168,9 +256,14 @@ class SoundManager:
                 self.volumes[x] = 1.0
             return self.sounds[x]
         for sound_conf in self.config_ref.sounds:
-            sem = SoundEntryManager(sound_conf)
+            sem = SoundEntryManager(sound_conf, self.trimmer, self.backend)
             x, y = sem.get_xy()
             get_x(x)[y] = sem
+            # a new entry at the position may have another mode
+            self._call_handler(sem)
+
+        # in the background, the new files are played untrimmed until they are analysed
+        self.backend.preprocess(self.config_ref, self.trimmer)
 
     def get_xy_for_disabled_sounds(self) -> list[tuple[int, int]]:
         result = []
@@ -183,16 +276,39 @@ class SoundManager:
         self.change_handler = handler
 
     def _call_handler(self, sound: SoundEntryManager):
+        x, y = sound.get_xy()
+        if not self.state_table.update(x, y, sound.is_playing(), sound.is_paused(), sound.config_ref.mode):
+            # e.g. a hit which layers another sound on a playing entry
+            return
         if self.change_handler is not None:
             self.change_handler(sound)
 
     def hit_note(self, x, y):
-        try:
-            sound = self.sounds[x][y]
-            sound.hit()
+        with tracer.span("SoundManager.hit_note", {"x": x, "y": y}) if tracer.enabled else NO_SPAN:
+            try:
+                sound = self.sounds[x][y]
+            except KeyError:
+                return
+            if sound.hit():
+                for cue in sound.config_ref.cues:
+                    self.scheduler.schedule(cue.delay, cue)
             self._call_handler(sound)
-        except KeyError:
-            pass
+
+    def release_note(self, x, y):
+        with tracer.span("SoundManager.release_note", {"x": x, "y": y}) if tracer.enabled else NO_SPAN:
+            try:
+                sound = self.sounds[x][y]
+                sound.release()
+                self._call_handler(sound)
+            except KeyError:
+                pass
+
+    def _trigger_cue(self, cue: sound_config.SoundCue):
+        match cue.action:
+            case sound_config.SoundCueAction.HIT:
+                self.hit_note(cue.x, cue.y)
+            case sound_config.SoundCueAction.RELEASE:
+                self.release_note(cue.x, cue.y)
 
     def iterate_sounds(self):
         for col in self.sounds.values():
@@ -200,23 +316,32 @@ class SoundManager:
                 yield sound
 
     def tick(self):
-       for sound in self.iterate_sounds():
-           if sound.tick():
-               self._call_handler(sound)
+        with tracer.span("SoundManager.tick"):
+            for sound in self.iterate_sounds():
+                if sound.tick():
+                    self._call_handler(sound)
 
     def stop(self):
+        self.scheduler.cancel_all()
         for sound in self.iterate_sounds():
             sound.stop()
             self._call_handler(sound)
 
-    def get_state(self) -> dict[int, dict[int, SoundState]]:
-        result = {}
-        for x in self.sounds:
-            result[x] = {}
-            for y in self.sounds[x]:
-                result[x][y] = self.sounds[x][y].get_state()
-        return result
-    
+    def get_memory_usage(self) -> tuple[dict[tuple[int, int], int], dict[SoundStorage, int]]:
+        """
+        Returns the memory of the stored samples in bytes, per position and per storage tier. A file which is used
+        by several positions counts for each of them, but only once for its tier.
+        """
+        pads = {}
+        for sound in self.iterate_sounds():
+            size = 0
+            for path in set(sound.sound_list):
+                usage = self.backend.get_memory_usage(path, sound.config_ref.storage)
+                if usage is not None:
+                    size += usage[1]
+            pads[sound.get_xy()] = size
+        return pads, self.backend.get_memory_by_storage()
+
     def set_volume(self, x: int, volume: float | None = None):
         try:
             if volume is not None:
@@ -0,0 +1,96 @@
+"""A module to store the sound states of all pads in flat arrays, with a version counter to query the changes since an earlier version."""
+from array import array
+
+from sound_config import SoundPlayMode, SoundState
+
+PLAY_MODES = list(SoundPlayMode)
+MODE_INDEXES = {mode: i for i, mode in enumerate(PLAY_MODES)}
+# the states are immutable, so all pads share the few possible state objects, indexed by the flags and the mode index
+STATES = [
+    SoundState(bool(playing), bool(paused), mode)
+    for playing in range(2) for paused in range(2) for mode in PLAY_MODES
+]
+
+class SoundStateTable:
+    """
+    The playing and paused flags and the play mode index of every pad, in flat arrays indexed by the pad.
+
+    Every change increments the version of the table and is stored as the version of the pad. A consumer remembers
+    the last version it has seen and asks only for the pads which changed since then, instead of copying all states.
+
+    The sound manager keeps the table of the engine, which is read by all consumers of the states. The table is
+    written by one thread and can be read by others. The flags of a pad are written before its version and the
+    version of the table, so a reader which got version N has seen every change up to N.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.indexes: dict[tuple[int, int], int] = {}
+        self.positions: list[tuple[int, int]] = []
+        self.playing = bytearray()
+        self.paused = bytearray()
+        self.modes = bytearray()
+        self.versions = array("Q")
+
+    def _get_index(self, x: int, y: int) -> int:
+        index = self.indexes.get((x, y))
+        if index is None:
+            index = len(self.positions)
+            self.positions.append((x, y))
+            self.playing.append(0)
+            self.paused.append(0)
+            self.modes.append(0)
+            self.versions.append(0)
+            self.indexes[(x, y)] = index
+        return index
+
+    def update(self, x: int, y: int, playing: bool, paused: bool, mode: SoundPlayMode) -> bool:
+        """
+        Store the state of the pad at position xy. Returns True if the state changed.
+        """
+        index = self._get_index(x, y)
+        mode_index = MODE_INDEXES[mode]
+        if (
+            self.versions[index] != 0
+            and self.playing[index] == playing
+            and self.paused[index] == paused
+            and self.modes[index] == mode_index
+        ):
+            return False
+        self.playing[index] = playing
+        self.paused[index] = paused
+        self.modes[index] = mode_index
+        version = self.version + 1
+        self.versions[index] = version
+        self.version = version
+        return True
+
+    def _get_state(self, index: int) -> SoundState:
+        return STATES[((self.playing[index] << 1) | self.paused[index]) * len(PLAY_MODES) + self.modes[index]]
+
+    def get_state(self, x: int, y: int) -> SoundState | None:
+        """
+        Returns the state of the pad at position xy, None if it never had a state.
+        """
+        index = self.indexes.get((x, y))
+        if index is None:
+            return None
+        return self._get_state(index)
+
+    def get_changes_since(self, version: int) -> tuple[int, dict[tuple[int, int], SoundState]]:
+        """
+        Returns the current version and the states of the pads which changed after the given version.
+
+        Args:
+            version(int): The version returned by the previous call, 0 to get the states of all pads.
+
+        """
+        current = self.version
+        if version >= current:
+            return current, {}
+        versions = self.versions
+        return current, {
+            self.positions[i]: self._get_state(i)
+            for i in range(len(versions))
+            if versions[i] > version
+        }
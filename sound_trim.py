@@ -0,0 +1,287 @@
+"""A module to detect the silence at the start and the end of sound files, so a key hit is heard at once."""
+import os
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from pygame import mixer, sndarray
+
+import sound_config
+
+DEFAULT_CACHE_DATABASE = "sound_trim_cache.db"
+DEFAULT_THRESHOLD_DB = -60.0
+# kept in front of the first and after the last loud sample, so the attack and the release are not cut
+TRIM_MARGIN = 0.005
+SCAN_BLOCK_FRAMES = 4096
+DEFAULT_TRIM_WORKERS = min(4, os.cpu_count() or 1)
+
+@dataclass(slots=True)
+class TrimPoints:
+    """The part of a sound file to play, in seconds from the start of the file."""
+    start: float
+    end: float
+    duration: float
+
+    def is_trimmed(self) -> bool:
+        return self.start > 0.0 or self.end < self.duration
+
+    def get_frames(self, rate: float, frames: int) -> tuple[int, int]:
+        """
+        Returns the first frame and the frame after the part to play, at the given sample rate and number of frames.
+        """
+        start = min(round(self.start * rate), frames)
+        end = max(start, min(round(self.end * rate), frames))
+        return start, end
+
+    def apply(self, sound: mixer.Sound) -> mixer.Sound:
+        """
+        Returns a new sound with only the part between the trim points, or the sound itself if nothing is trimmed.
+        """
+        if not self.is_trimmed():
+            return sound
+        # a view of the decoded samples, the slice is copied once by make_sound
+        samples = sndarray.samples(sound)
+        start, end = self.get_frames(mixer.get_init()[0], len(samples))
+        return sndarray.make_sound(samples[start:end])
+
+def find_trim_points(samples: np.ndarray, rate: int, threshold_db: float = DEFAULT_THRESHOLD_DB) -> TrimPoints:
+    """
+    Returns the trim points of decoded samples: a frame is silent if every channel is below the threshold.
+
+    Args:
+        samples(np.ndarray): The samples as returned by pygame.sndarray, one row per frame and one column per channel.
+        rate(int): The sample rate.
+        threshold_db(float): The threshold in dB relative to the full scale of the sample format.
+
+    """
+    frames = len(samples)
+    duration = frames / rate
+    if frames == 0:
+        return TrimPoints(0.0, 0.0, 0.0)
+    if np.issubdtype(samples.dtype, np.floating):
+        full_scale = 1.0
+    else:
+        info = np.iinfo(samples.dtype)
+        full_scale = (int(info.max) - int(info.min) + 1) / 2
+        if info.min == 0:
+            # unsigned samples are centered around the middle of the range
+            samples = samples.astype(np.int32) - int(full_scale)
+    threshold = full_scale * 10.0 ** (threshold_db / 20.0)
+
+    first = _find_first_loud(samples, threshold)
+    if first is None:
+        # only silence, played as it is
+        return TrimPoints(0.0, duration, duration)
+    # a reversed view, not a copy
+    last = frames - _find_first_loud(samples[::-1], threshold)
+
+    margin = int(TRIM_MARGIN * rate)
+    start = max(0, first - margin)
+    end = min(frames, last + margin)
+    return TrimPoints(start / rate, end / rate, duration)
+
+def _find_first_loud(samples: np.ndarray, threshold: float) -> int | None:
+    """
+    Returns the index of the first frame with a channel above the threshold, None if there is none.
+
+    The samples are compared in blocks of a growing size, so only the start of a file is scanned if it
+    has a short silence, and a long silence is still scanned with few large numpy operations.
+    """
+    begin = 0
+    block_size = SCAN_BLOCK_FRAMES
+    while begin < len(samples):
+        block = samples[begin:begin + block_size]
+        # compared without np.abs, which overflows for the minimum of an integer type
+        loud = (block > threshold) | (block < -threshold)
+        if loud.ndim > 1:
+            loud = loud.any(axis=1)
+        index = int(np.argmax(loud))
+        if loud[index]:
+            return begin + index
+        begin += block_size
+        block_size *= 2
+    return None
+
+def analyse_file(path: str, threshold_db: float = DEFAULT_THRESHOLD_DB) -> TrimPoints:
+    """
+    Decode a sound file with the mixer and return its trim points. Raises an exception if the file can't be read.
+    """
+    sound = mixer.Sound(path)
+    return find_trim_points(sndarray.samples(sound), mixer.get_init()[0], threshold_db)
+
+class TrimCache:
+    """
+    A class to store the trim points of sound files in a SQLite database.
+
+    The entries are keyed by the path, size and modification time of the file and by the threshold,
+    so a changed file is analysed again. Every thread uses its own database connection.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_CACHE_DATABASE):
+        self.db_path = db_path
+        self.local = threading.local()
+        with self._connection() as con:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS trims (
+                    path TEXT NOT NULL,
+                    threshold REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    start REAL NOT NULL,
+                    end REAL NOT NULL,
+                    duration REAL NOT NULL,
+                    PRIMARY KEY (path, threshold)
+                )
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        con = getattr(self.local, "connection", None)
+        if con is None:
+            con = sqlite3.connect(self.db_path, timeout=10)
+            con.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = con
+        return con
+
+    def get(self, path: str, size: int, mtime: float, threshold_db: float) -> TrimPoints | None:
+        row = self._connection().execute(
+            "SELECT start, end, duration FROM trims WHERE path = ? AND threshold = ? AND size = ? AND mtime = ?",
+            (path, threshold_db, size, mtime)
+        ).fetchone()
+        if row is None:
+            return None
+        return TrimPoints(*row)
+
+    def store(self, path: str, size: int, mtime: float, threshold_db: float, trim: TrimPoints):
+        with self._connection() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO trims VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, threshold_db, size, mtime, trim.start, trim.end, trim.duration)
+            )
+
+class SoundTrimmer:
+    """
+    A class to find the trim points of all files of a board in a pool of worker threads.
+
+    The sound manager asks for the trim points on every hit. Files which are not analysed yet are played untrimmed,
+    so a hit never waits for the analysis. A file which is decoded anyway, e.g. by the sample store, is analysed from
+    that decoded sound with analyse_decoded instead of being decoded a second time.
+    """
+
+    def __init__(self, cache: TrimCache | None = None, workers: int = DEFAULT_TRIM_WORKERS):
+        """
+        Args:
+            cache(TrimCache): The persistent cache of the trim points, None to analyse every file on every start.
+            workers(int): The number of files analysed at the same time.
+
+        """
+        self.cache = cache
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="SoundTrimmer")
+        self.threshold_db = DEFAULT_THRESHOLD_DB
+        self.trims: dict[str, TrimPoints] = {}
+        # the files of the board which are trimmed
+        self.wanted: set[str] = set()
+        self.pending: set[tuple[str, float]] = set()
+        self.lock = threading.Lock()
+
+    def get_trim(self, path: str) -> TrimPoints | None:
+        """
+        Returns the trim points of a file, None if it is not analysed yet or can't be read.
+        """
+        return self.trims.get(path)
+
+    def preprocess(self, config: sound_config.SoundConfig, decoded_paths: set[str] | None = None) -> Future:
+        """
+        Start the analysis of all files of the board, which are not known yet. Returns a future which is done when
+        all files are analysed, with the number of analysed files.
+
+        Args:
+            config(SoundConfig): The board.
+            decoded_paths(set): The files which are decoded by another owner, who passes them to analyse_decoded.
+                They are not analysed here and not counted. None if there are none.
+
+        """
+        if config.silence_threshold_db != self.threshold_db:
+            self.threshold_db = config.silence_threshold_db
+            self.trims = {}
+        self.wanted = {
+            path
+            for entry in config.sounds if entry.trim_silence
+            for path in entry.files
+        }
+        threshold_db = self.threshold_db
+        decoded_paths = decoded_paths if decoded_paths is not None else set()
+        with self.lock:
+            paths = [
+                path for path in sorted(self.wanted)
+                if path not in self.trims and path not in decoded_paths and (path, threshold_db) not in self.pending
+            ]
+            self.pending.update((path, threshold_db) for path in paths)
+        futures = [self.pool.submit(self._analyse, path, threshold_db) for path in paths]
+
+        result = Future()
+        if len(futures) == 0:
+            result.set_result(0)
+            return result
+        remaining = len(futures)
+        def done_handler(_):
+            nonlocal remaining
+            with self.lock:
+                remaining -= 1
+                finished = remaining == 0
+            if finished:
+                result.set_result(len(futures))
+        for future in futures:
+            future.add_done_callback(done_handler)
+        return result
+
+    def analyse_decoded(self, path: str, sound: mixer.Sound):
+        """
+        Find the trim points of a file from its decoded sound, if the board trims the file and it isn't analysed yet.
+        Called in the thread which decoded the file.
+        """
+        if path not in self.wanted or path in self.trims:
+            return
+        self._analyse(path, self.threshold_db, sound)
+
+    def _analyse(self, path: str, threshold_db: float, sound: mixer.Sound | None = None):
+        try:
+            stat = os.stat(path)
+            trim = None
+            if self.cache is not None:
+                trim = self.cache.get(os.path.abspath(path), stat.st_size, stat.st_mtime, threshold_db)
+            if trim is None:
+                if sound is not None:
+                    trim = find_trim_points(sndarray.samples(sound), mixer.get_init()[0], threshold_db)
+                else:
+                    trim = analyse_file(path, threshold_db)
+                if self.cache is not None:
+                    self.cache.store(os.path.abspath(path), stat.st_size, stat.st_mtime, threshold_db, trim)
+            if threshold_db == self.threshold_db:
+                self.trims[path] = trim
+        except Exception:
+            # missing and unreadable files are marked by the sound manager
+            pass
+        finally:
+            with self.lock:
+                self.pending.discard((path, threshold_db))
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+if __name__ == "__main__":
+    """Find the silence in all files of a board and print it, the trim points are stored in the cache."""
+    import sys
+    import time
+
+    mixer.init()
+    config = sound_config.get_sound_config(sys.argv[1])
+    trimmer = SoundTrimmer(TrimCache())
+    start = time.perf_counter()
+    count = trimmer.preprocess(config).result()
+    duration = time.perf_counter() - start
+    for path, trim in sorted(trimmer.trims.items()):
+        print(f"{path}: leading {trim.start * 1000:.0f} ms, trailing {(trim.duration - trim.end) * 1000:.0f} ms")
+    print(f"Analysed {count} files in {duration:.2f} s with {DEFAULT_TRIM_WORKERS} workers")
+    trimmer.shutdown()
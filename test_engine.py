@@ -0,0 +1,40 @@
+"""Tests of the key latency of the sound engine, run with `python -m unittest` (or pytest) from the project folder."""
+import os
+# must be set before pygame opens the mixer
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import asyncio
+import unittest
+
+from key_latency import measure_key_latency
+
+# a loose bound of a key release of a gate entry, while all pads are released at the same time. It holds on a
+# loaded machine and still fails if a release waits for the polling interval or the ticker of the sound manager.
+MAX_RELEASE_LATENCY_NS = 50_000_000
+# the bound of the benchmark, which is only run with RUN_BENCHMARKS=1 on an otherwise idle machine
+BENCHMARK_MAX_RELEASE_LATENCY_NS = 10_000_000
+ROUNDS = 20
+PADS = 8 * 8
+
+def _release_p99(latencies: dict[bool, list[int]]) -> int:
+    releases = sorted(latencies[False])
+    return releases[len(releases) * 99 // 100]
+
+class GateLatencyTest(unittest.TestCase):
+
+    def test_release_latency_under_burst(self):
+        latencies = asyncio.run(measure_key_latency(rounds=ROUNDS))
+        # every press and release of every burst changes the state of its pad
+        self.assertEqual(len(latencies[True]), ROUNDS * PADS)
+        self.assertEqual(len(latencies[False]), ROUNDS * PADS)
+        p99 = _release_p99(latencies)
+        self.assertLess(p99, MAX_RELEASE_LATENCY_NS, f"99th percentile of the releases is {p99 / 1e6:.2f} ms")
+
+    @unittest.skipUnless(os.environ.get("RUN_BENCHMARKS") == "1", "set RUN_BENCHMARKS=1 to run the benchmarks")
+    def test_release_latency_benchmark(self):
+        latencies = asyncio.run(measure_key_latency())
+        p99 = _release_p99(latencies)
+        self.assertLess(p99, BENCHMARK_MAX_RELEASE_LATENCY_NS, f"99th percentile of the releases is {p99 / 1e6:.2f} ms")
+
+if __name__ == "__main__":
+    unittest.main()
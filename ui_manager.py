@@ -1,7 +1,11 @@
 import sound_config
+from sound_library import SoundLibrary, find_sound_files, read_audio_info
+from board_writer import BoardWriter
+from sound_state_table import SoundStateTable
 
 import tkinter as tk
 from tkinter import ttk
+from tkinter import font as tkfont
 from tkinter.messagebox import showwarning, showinfo
 from tkinter.filedialog import asksaveasfilename, askopenfilename
 from tkinterdnd2 import DND_FILES, TkinterDnD
@@ -9,13 +13,29 @@ import threading
 from functools import partial
 import pathlib
 from typing import Callable, Any
-import yaml
-import jinja2
 from enum import Enum
-from queue import Queue
+from concurrent.futures import Future, CancelledError, ThreadPoolExecutor
+from queue import SimpleQueue
+import os
+import asyncio
+import inspect
+import time
+
+FILE_CHECK_WORKERS = 2
+FILE_CHECK_BATCH_SIZE = 100
+FILE_LIST_POLL_INTERVAL_MS = 100
+
+def to_relative_path(path: pathlib.Path) -> pathlib.Path:
+    """
+    Returns the path relative to the tool directory if possible, otherwise the path itself.
+    """
+    try:
+        return path.relative_to(pathlib.Path(__file__).parent, walk_up=True)
+    except ValueError:
+        return path
 
 class UiEntryManager:
-    def __init__(self, parent, config_ref: sound_config.SoundEntry):
+    def __init__(self, parent, config_ref: sound_config.SoundEntry, library: SoundLibrary | None = None):
         self.top = tk.Toplevel(parent)
         self.top.title("Edit Entry")
         self.top.transient(parent)
@@ -32,7 +52,7 @@ class UiEntryManager:
         frame = tk.Frame(self.top)
         frame.pack(fill="both", expand=True)
         frame.grid_columnconfigure(1, weight=1)
-        frame.grid_rowconfigure(3, weight=1)
+        frame.grid_rowconfigure(5, weight=1)
 
 
         text_label = tk.Label(frame, text="Text:")
@@ -65,61 +85,91 @@ class UiEntryManager:
         sequence_select['state'] = 'readonly'
         sequence_select.current(sequence_options.index(config_ref.file_select.value))
         sequence_select.grid(column=1, row=2, **grid_args)
+
+
+        storage_label = tk.Label(frame, text="Storage:")
+        storage_label.grid(column=0, row=3, **grid_args)
+
+        storage_string = tk.StringVar()
+        storage_select = ttk.Combobox(frame, textvariable=storage_string)
+        storage_options = [e.value for e in sound_config.SoundStorage]
+        storage_select['values'] = storage_options
+        storage_select['state'] = 'readonly'
+        storage_select.current(storage_options.index(config_ref.storage.value))
+        storage_select.grid(column=1, row=3, **grid_args)
+
+
+        trim_silence = tk.BooleanVar(value=config_ref.trim_silence)
+        trim_check = tk.Checkbutton(frame, text="Skip silence at the start and the end", variable=trim_silence, anchor=tk.W)
+        trim_check.grid(column=1, row=4, **grid_args)
         
 
         files_label = tk.Label(frame, text="Files:")
-        files_label.grid(column=0, row=3, **grid_args)
-
-        files_listbox = tk.Listbox(frame, selectmode=tk.EXTENDED)
-        for file in config_ref.files:
-            files_listbox.insert(tk.END, file)
-
-        def delete_handler(*args):
-            selected_entries = files_listbox.curselection()
-            for idx in sorted(selected_entries, reverse=True):
-                files_listbox.delete(idx)
-
-        def move_handler(move_up: bool = True, *args):
-            selected_entries = files_listbox.curselection()
-            selection_groups = []
-            last_entry_selected = None
-            for idx, file in enumerate(files_listbox.get(0, tk.END)):
-                is_selected = idx in selected_entries
-                if not is_selected or is_selected != last_entry_selected:
-                    group_idx =  len(selection_groups)
-                    if is_selected:
-                        group_idx += -1.5 if move_up else 1.5
-                    selection_groups.append([group_idx, is_selected])
-                    last_entry_selected = is_selected
-                selection_groups[-1].append(file)
-            selection_groups = sorted(selection_groups, key=lambda e: e[0])
-            files_listbox.delete(0, tk.END)
-            for group in selection_groups:
-                for file in group[2:]:
-                    files_listbox.insert(tk.END, file)
-                    if group[1]:
-                        files_listbox.selection_set(tk.END)
-            return "break"
-        
-        def drop_handler(event):
-            files = self.top.tk.splitlist(event.data)
-            paths = [pathlib.Path(file) for file in files]
-            ref_path = pathlib.Path(__file__).parent
-            def try_to_rel(path: pathlib.Path) -> pathlib.Path:
+        files_label.grid(column=0, row=5, **grid_args)
+
+        file_list = UiFileList(frame, config_ref.files)
+        file_list.frame.grid(column=1, row=5, **grid_args)
+
+        button_row = 6
+        if library is not None:
+            search_label = tk.Label(frame, text="Library:")
+            search_label.grid(column=0, row=6, **grid_args)
+
+            search_entry = tk.Entry(frame)
+            search_entry.grid(column=1, row=6, **grid_args)
+
+            results_listbox = tk.Listbox(frame, selectmode=tk.EXTENDED, height=8)
+            results_listbox.grid(column=1, row=7, **grid_args)
+            result_paths: list[str] = []
+            search_job = None
+            # a search of a large library takes longer than a key press, so it runs in the background
+            search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="UiLibrarySearch")
+            search_future: Future | None = None
+            results_listbox.bind("<Destroy>", lambda e: search_executor.shutdown(wait=False, cancel_futures=True))
+
+            def search():
+                nonlocal search_job, search_future
+                search_job = None
+                if search_future is not None:
+                    search_future.cancel()
+                search_future = search_executor.submit(library.search, search_entry.get())
+                results_listbox.after(FILE_LIST_POLL_INTERVAL_MS, show_results, search_future)
+
+            def show_results(future: Future):
+                if future is not search_future or not results_listbox.winfo_exists():
+                    # replaced by a newer search or the window is closed
+                    return
+                if not future.done():
+                    results_listbox.after(FILE_LIST_POLL_INTERVAL_MS, show_results, future)
+                    return
                 try:
-                    return path.relative_to(ref_path, walk_up=True)
-                except ValueError:
-                    return path
-            rel_paths = [ try_to_rel(path) for path in paths]
-            for path in rel_paths:
-                files_listbox.insert(tk.END, str(path))
-
-        files_listbox.bind("<Delete>", delete_handler)
-        files_listbox.bind("<Up>", partial(move_handler, True))
-        files_listbox.bind("<Down>", partial(move_handler, False))
-        files_listbox.drop_target_register(DND_FILES)
-        files_listbox.dnd_bind("<<Drop>>", drop_handler)
-        files_listbox.grid(column=1, row=3, **grid_args)
+                    results = future.result()
+                except Exception:
+                    results = []
+                result_paths.clear()
+                results_listbox.delete(0, tk.END)
+                for info in results:
+                    result_paths.append(info.path)
+                    results_listbox.insert(tk.END, f"{info.path} ({info.duration:.1f} s)" if info.duration is not None else info.path)
+
+            def search_handler(*args):
+                # search once the typing pauses
+                nonlocal search_job
+                if search_job is not None:
+                    self.top.after_cancel(search_job)
+                search_job = self.top.after(150, search)
+
+            def add_handler(*args):
+                file_list.add_files([
+                    str(to_relative_path(pathlib.Path(result_paths[idx])))
+                    for idx in results_listbox.curselection()
+                ])
+                return "break"
+
+            search_entry.bind("<KeyRelease>", search_handler)
+            results_listbox.bind("<Double-Button-1>", add_handler)
+            results_listbox.bind("<Return>", add_handler)
+            button_row = 8
 
 
         def del_close_handler(*args):
@@ -128,12 +178,10 @@ class UiEntryManager:
             self.top = None
 
         del_btn = tk.Button(frame, text="Delete & Close", command=del_close_handler)
-        del_btn.grid(column=0, row=4, **grid_args)
+        del_btn.grid(column=0, row=button_row, **grid_args)
         
         def save_close_handler():
-            files=list(
-                files_listbox.get(0, tk.END)
-            )
+            files=list(file_list.files)
 
             sequence = sound_config.SoundFileSelect(sequence_string.get())
             mode = sound_config.SoundPlayMode(mode_string.get())
@@ -141,13 +189,15 @@ class UiEntryManager:
             self.result.text = text_entry.get()
             self.result.file_select=sequence
             self.result.mode=mode
+            self.result.trim_silence=trim_silence.get()
+            self.result.storage=sound_config.SoundStorage(storage_string.get())
             self.result.files=files
 
             self.top.destroy()
             self.top = None
 
         save_btn = tk.Button(frame, text="Save & Close", command=save_close_handler)
-        save_btn.grid(column=1, row=4, **grid_args)
+        save_btn.grid(column=1, row=button_row, **grid_args)
 
         # Center above parent
         px = parent.winfo_rootx()
@@ -168,19 +218,271 @@ class UiEntryManager:
         if self.top is not None:
             self.top.destroy()
 
+class UiFileList:
+    """
+    The list of sound files in the entry editor, suitable for thousands of files.
+
+    Only the visible rows are drawn, the files are kept in a python list. Dropped folders are searched
+    and the files are checked in background threads; the results are drawn with after().
+    """
+
+    STATUS_PENDING = "\u2026"
+    STATUS_OK = "\u2713"
+    STATUS_MISSING = "\u2717 missing:"
+    STATUS_UNREADABLE = "\u2717 unreadable:"
+
+    def __init__(self, parent, files: list[str]):
+        self.frame = tk.Frame(parent)
+        self.frame.grid_columnconfigure(0, weight=1)
+        self.frame.grid_rowconfigure(0, weight=1)
+
+        # the selection is handled in the model, the listbox only shows it
+        self.listbox = tk.Listbox(self.frame, selectmode=tk.EXTENDED, activestyle="none", exportselection=False)
+        self.listbox.grid(column=0, row=0, sticky=tk.NSEW)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.scroll_handler)
+        self.scrollbar.grid(column=1, row=0, sticky=tk.NS)
+
+        self.files: list[str] = []
+        self.selected: set[int] = set()
+        self.anchor = 0
+        self.offset = 0
+        self.rows = 10
+        self.row_height = tkfont.Font(font=self.listbox.cget("font")).metrics("linespace") + 1
+        self.status: dict[str, str] = {}
+        self.results: SimpleQueue = SimpleQueue()
+        self.executor = ThreadPoolExecutor(max_workers=FILE_CHECK_WORKERS, thread_name_prefix="UiFileList")
+
+        self.listbox.bind("<Configure>", self.resize_handler)
+        self.listbox.bind("<Button-1>", self.click_handler)
+        self.listbox.bind("<Shift-Button-1>", partial(self.click_handler, extend=True))
+        self.listbox.bind("<Control-Button-1>", partial(self.click_handler, toggle=True))
+        self.listbox.bind("<B1-Motion>", lambda e: "break")
+        self.listbox.bind("<MouseWheel>", lambda e: self.scroll_rows(-3 if e.delta > 0 else 3))
+        self.listbox.bind("<Button-4>", lambda e: self.scroll_rows(-3))
+        self.listbox.bind("<Button-5>", lambda e: self.scroll_rows(3))
+        self.listbox.bind("<Delete>", self.delete_handler)
+        self.listbox.bind("<Up>", partial(self.move_handler, True))
+        self.listbox.bind("<Down>", partial(self.move_handler, False))
+        self.listbox.bind("<Destroy>", lambda e: self.executor.shutdown(wait=False, cancel_futures=True))
+        self.listbox.drop_target_register(DND_FILES)
+        self.listbox.dnd_bind("<<Drop>>", self.drop_handler)
+
+        self.add_files(files)
+        self.listbox.after(FILE_LIST_POLL_INTERVAL_MS, self.poll_results)
+
+    def add_files(self, files: list[str]):
+        self.files.extend(files)
+        self.check_files(files)
+        self.draw()
+
+    def check_files(self, files: list[str]):
+        new_files = [file for file in dict.fromkeys(files) if file not in self.status]
+        for file in new_files:
+            self.status[file] = self.STATUS_PENDING
+        for idx in range(0, len(new_files), FILE_CHECK_BATCH_SIZE):
+            self.executor.submit(self._check_files, new_files[idx:idx + FILE_CHECK_BATCH_SIZE])
+
+    def _check_files(self, files: list[str]):
+        results = []
+        for file in files:
+            if not os.path.exists(file):
+                results.append((file, self.STATUS_MISSING))
+                continue
+            try:
+                read_audio_info(file)
+                results.append((file, self.STATUS_OK))
+            except Exception:
+                results.append((file, self.STATUS_UNREADABLE))
+        self.results.put(("status", results))
+
+    def _expand_folders(self, paths: list[pathlib.Path]):
+        files = []
+        for path in paths:
+            if path.is_dir():
+                files.extend(find_sound_files(str(path)))
+            else:
+                files.append(str(path))
+        self.results.put(("add", [str(to_relative_path(pathlib.Path(file))) for file in files]))
+
+    def poll_results(self):
+        if not self.listbox.winfo_exists():
+            return
+        changed = False
+        while not self.results.empty():
+            kind, values = self.results.get()
+            match kind:
+                case "status":
+                    self.status.update(values)
+                case "add":
+                    self.files.extend(values)
+                    self.check_files(values)
+            changed = True
+        if changed:
+            self.draw()
+        self.listbox.after(FILE_LIST_POLL_INTERVAL_MS, self.poll_results)
+
+    def draw(self):
+        self.offset = max(0, min(self.offset, len(self.files) - self.rows))
+        visible = self.files[self.offset:self.offset + self.rows]
+        self.listbox.delete(0, tk.END)
+        if len(visible) > 0:
+            self.listbox.insert(tk.END, *[f"{self.status.get(file, self.STATUS_PENDING)} {file}" for file in visible])
+        for row in range(len(visible)):
+            if self.offset + row in self.selected:
+                self.listbox.selection_set(row)
+        if len(self.files) > 0:
+            self.scrollbar.set(self.offset / len(self.files), min(1.0, (self.offset + self.rows) / len(self.files)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def resize_handler(self, event):
+        rows = max(1, (event.height - 4) // self.row_height)
+        if rows != self.rows:
+            self.rows = rows
+            self.draw()
+
+    def scroll_handler(self, *args):
+        match args:
+            case ("moveto", fraction):
+                self.offset = int(float(fraction) * len(self.files))
+            case ("scroll", count, "units"):
+                self.offset += int(count)
+            case ("scroll", count, "pages"):
+                self.offset += int(count) * self.rows
+        self.draw()
+
+    def scroll_rows(self, count: int):
+        self.offset += count
+        self.draw()
+        return "break"
+
+    def ensure_visible(self, idx: int):
+        if idx < self.offset:
+            self.offset = idx
+        elif idx >= self.offset + self.rows:
+            self.offset = idx - self.rows + 1
+
+    def click_handler(self, event, extend: bool = False, toggle: bool = False):
+        self.listbox.focus_set()
+        if len(self.files) == 0:
+            return "break"
+        idx = min(self.offset + self.listbox.nearest(event.y), len(self.files) - 1)
+        if extend:
+            low, high = sorted((self.anchor, idx))
+            self.selected = set(range(low, high + 1))
+        elif toggle:
+            self.selected ^= {idx}
+            self.anchor = idx
+        else:
+            self.selected = {idx}
+            self.anchor = idx
+        self.draw()
+        return "break"
+
+    def delete_handler(self, *args):
+        self.files = [file for idx, file in enumerate(self.files) if idx not in self.selected]
+        self.selected.clear()
+        self.draw()
+        return "break"
+
+    def move_handler(self, move_up: bool = True, *args):
+        # every selected file swaps with its unselected neighbour, so blocks of selected files move by one
+        step = -1 if move_up else 1
+        order = range(len(self.files)) if move_up else range(len(self.files) - 1, -1, -1)
+        selected = set()
+        for idx in order:
+            if idx not in self.selected:
+                continue
+            neighbour = idx + step
+            if 0 <= neighbour < len(self.files) and neighbour not in selected:
+                self.files[idx], self.files[neighbour] = self.files[neighbour], self.files[idx]
+                selected.add(neighbour)
+            else:
+                selected.add(idx)
+        self.selected = selected
+        if len(selected) > 0:
+            self.ensure_visible(min(selected) if move_up else max(selected))
+        self.draw()
+        return "break"
+
+    def drop_handler(self, event):
+        paths = [pathlib.Path(file) for file in self.listbox.tk.splitlist(event.data)]
+        if any(path.is_dir() for path in paths):
+            self.executor.submit(self._expand_folders, paths)
+        else:
+            self.add_files([str(to_relative_path(path)) for path in paths])
+
 class UiManagerRequests(Enum):
     GET_SOUND_ERROR_POSITIONS=0,
     RELOAD_AFTER_CONFIG_CHANGE=1,
     GET_MIDI_DEVICES=2,
-    GET_DEVICE_OPEN_STATE=3
+    GET_DEVICE_OPEN_STATE=3,
+    TOGGLE_PROFILING=4,
+    TOGGLE_TRACING=5,
+    TAKE_MEMORY_SNAPSHOT=6,
+    GET_MEMORY_USAGE=7
+
+UI_FRAME_RATE = 25
+REQUEST_TIMEOUT = 5.0
+REQUEST_POLL_INTERVAL_MS = 10
+SAVE_TIMEOUT = 60.0
+AUTOSAVE_INTERVAL = 60
+
+STATE_COLORS = {
+    sound_config.SoundPlayMode.PLAY: ("#FF6060", "#FFB0B0"),
+    sound_config.SoundPlayMode.PLAY_AND_PAUSE: ("#6060FF", "#B0B0FF"),
+    sound_config.SoundPlayMode.PLAY_AND_STOP: ("#60FF60", "#B0FFB0"),
+    sound_config.SoundPlayMode.GATE: ("#E0E040", "#F0F0A0"),
+}
+
+class UiStateQueue:
+    """
+    A queue of sound states, which keeps only the latest state of each position.
+
+    The states are read from the state table of the engine, which is written by another thread, e.g. the thread of the
+    asyncio event loop, and drained by the thread of the ui.
+    """
+
+    def __init__(self, table: SoundStateTable):
+        """
+        Args:
+            table(SoundStateTable): The states of the engine, e.g. the state_table of the sound manager.
+
+        """
+        self.table = table
+        self.drained_version = 0
+
+    def drain(self) -> dict[tuple[int, int], Any]:
+        """
+        Returns the states which changed since the last call by their position.
+        """
+        self.drained_version, states = self.table.get_changes_since(self.drained_version)
+        return states
 
 class UiManager:
-    def __init__(self, parent, config_ref: sound_config.SoundConfig, dimensions: tuple[int, int], request_handler: Callable[[UiManagerRequests], Any]):
+    def __init__(self, parent, config_ref: sound_config.SoundConfig, dimensions: tuple[int, int], request_bridge: "UiRequestBridge", state_queue: UiStateQueue | None = None, library: SoundLibrary | None = None, autosave_interval: int = AUTOSAVE_INTERVAL):
         self.parent = parent
 
         self.config_ref = config_ref
         self.dim = dimensions
-        self.request_handler = request_handler
+        self.request_bridge = request_bridge
+        self.state_queue = state_queue
+        self.library = library
+        self.board_writer = BoardWriter()
+        # the file the board was opened from or saved to, autosaves are written next to it
+        self.save_path: str | None = None
+        self.autosave_interval = autosave_interval
+        self.change_count = 0
+        self.autosaved_change_count = 0
+        # requests waiting for an answer of the engine: future, result callback, error callback, deadline
+        self.pending_requests: list[tuple[Future, Callable[[Any], None] | None, Callable[[Exception], None] | None, float]] = []
+
+        self.entries: dict[tuple[int, int], sound_config.SoundEntry] = {}
+        self.disabled_positions: set[tuple[int, int]] = set()
+        self.sound_states: dict[tuple[int, int], Any] = {}
+        self.buttons: dict[tuple[int, int], tk.Button] = {}
+        # the last options set per button, to only reconfigure changed buttons
+        self.button_options: dict[tuple[int, int], dict[str, str]] = {}
 
         self.parent.title("GM Midi Soundboard")
 
@@ -193,86 +495,199 @@ class UiManager:
         filemenu.add_command(label="Save", command=self.on_save_handler)
         filemenu.add_separator()
         filemenu.add_command(label="List Midi Devices", command=self.show_midi_devices)
+        filemenu.add_command(label="Engine Request Statistics", command=self.show_request_statistics)
+        filemenu.add_command(label="Stored Sample Memory", command=self.show_memory_usage)
+        if self.library is not None:
+            filemenu.add_command(label="Board Memory Estimate", command=self.show_memory_estimate)
+        filemenu.add_separator()
+        filemenu.add_command(label="Start/Stop Profiling", command=partial(self.toggle_profiling_tool, UiManagerRequests.TOGGLE_PROFILING, "Profiling"))
+        filemenu.add_command(label="Start/Stop Tracing", command=partial(self.toggle_profiling_tool, UiManagerRequests.TOGGLE_TRACING, "Tracing"))
+        filemenu.add_command(label="Memory Snapshot", command=partial(self.toggle_profiling_tool, UiManagerRequests.TAKE_MEMORY_SNAPSHOT, "Memory tracing"))
         
         self.button_frame = tk.Frame(self.parent)
         self.button_frame.pack(fill="both", expand=True)
         self.button_frame.grid_columnconfigure(list(range(dimensions[0])), weight=1)
         self.button_frame.grid_rowconfigure(list(range(dimensions[1])), weight=1)
+        self.create_buttons()
 
         self.reload_changed_config()
+        if self.state_queue is not None:
+            self.parent.after(1000 // UI_FRAME_RATE, self.draw_queued_states)
+        if self.autosave_interval > 0:
+            self.parent.after(self.autosave_interval * 1000, self.autosave)
         self.parent.eval('tk::PlaceWindow . center')
         self.parent.attributes("-topmost", True)
         self.parent.attributes("-topmost", False)
 
         self.drag_btn = None
 
-        device_open_state = self.request_handler(UiManagerRequests.GET_DEVICE_OPEN_STATE)
-        match device_open_state:
-            case [False, _]:
-                showwarning("Warning", "Can't open midi device for input and output.", parent=self.parent)
-            case [True, False]:
-                showwarning("Warning", "Can't open midi device for output. Colored keys are not available.", parent=self.parent)
-
-        self.open_sound_file()
+        def device_open_state_handler(device_open_state):
+            match device_open_state:
+                case [False, _]:
+                    showwarning("Warning", "Can't open midi device for input and output.", parent=self.parent)
+                case [True, False]:
+                    showwarning("Warning", "Can't open midi device for output. Colored keys are not available.", parent=self.parent)
+            self.open_sound_file()
+
+        def device_open_state_error_handler(error: Exception):
+            self.show_request_error(error)
+            self.open_sound_file()
+
+        self.call_engine(
+            UiManagerRequests.GET_DEVICE_OPEN_STATE,
+            device_open_state_handler,
+            on_error=device_open_state_error_handler
+        )
+
+    def call_engine(self, request: UiManagerRequests, on_result: Callable[[Any], None] | None = None, *args, on_error: Callable[[Exception], None] | None = None, timeout: float = REQUEST_TIMEOUT):
+        """
+        Send a request to the engine without blocking the UI.
+
+        The callbacks are called in the Tk thread. Without an error callback, errors are shown in a warning dialog.
+
+        Args:
+            request(UiManagerRequests): The request to send.
+            on_result: A callable which is called with the result of the request.
+            args: The arguments of the request.
+            on_error: A callable which is called with the exception, if the request failed or timed out.
+            timeout(float): The time in seconds to wait for the result.
+
+        """
+        if on_error is None:
+            on_error = self.show_request_error
+        def error_handler(error: Exception):
+            if isinstance(error, TimeoutError):
+                self.request_bridge.count_timeout()
+            on_error(error)
+        self.watch_future(self.request_bridge.request(request, *args), on_result, error_handler, timeout)
+
+    def watch_future(self, future: Future, on_result: Callable[[Any], None] | None = None, on_error: Callable[[Exception], None] | None = None, timeout: float = REQUEST_TIMEOUT):
+        """
+        Call the result or error callback in the Tk thread, once the future is done or timed out.
+        """
+        if on_error is None:
+            on_error = self.show_request_error
+        self.pending_requests.append((future, on_result, on_error, time.monotonic() + timeout))
+        if len(self.pending_requests) == 1:
+            self.parent.after(REQUEST_POLL_INTERVAL_MS, self.poll_pending_requests)
+
+    def poll_pending_requests(self):
+        now = time.monotonic()
+        pending = []
+        finished = []
+        for entry in self.pending_requests:
+            future, _, _, deadline = entry
+            if future.done() or now > deadline:
+                finished.append(entry)
+            else:
+                pending.append(entry)
+        self.pending_requests = pending
+        if len(pending) > 0:
+            self.parent.after(REQUEST_POLL_INTERVAL_MS, self.poll_pending_requests)
+
+        for future, on_result, on_error, _ in finished:
+            if not future.done():
+                # stops the request if it didn't start yet
+                future.cancel()
+                on_error(TimeoutError("No answer in time."))
+            elif future.cancelled():
+                continue
+            elif future.exception() is not None:
+                on_error(future.exception())
+            elif on_result is not None:
+                on_result(future.result())
+
+    def show_memory_estimate(self):
+        size, unknown = self.library.estimate_board_memory(self.config_ref)
+        message_text = f"Decoded memory if every entry plays its largest file: {size / (1 << 20):.1f} MiB"
+        if unknown > 0:
+            message_text += f"\n{unknown} files are not in the library and not included."
+        showinfo("Board Memory Estimate", message_text, parent=self.parent)
+
+    def toggle_profiling_tool(self, request: UiManagerRequests, name: str):
+        def result_handler(path: str | None):
+            if path is None:
+                showinfo(name, f"{name} started.", parent=self.parent)
+            else:
+                showinfo(name, f"Written to {path}", parent=self.parent)
+        self.call_engine(request, result_handler)
+
+    def show_memory_usage(self):
+        def memory_usage_handler(report: str):
+            showinfo("Stored Sample Memory", report, parent=self.parent)
+        self.call_engine(UiManagerRequests.GET_MEMORY_USAGE, memory_usage_handler)
+
+    def show_request_error(self, error: Exception):
+        showwarning("Warning", f"Request to the engine failed: {error}", parent=self.parent)
+
+    def show_request_statistics(self):
+        stats = self.request_bridge.get_statistics()
+        message_text = "\n".join([
+            f"Requests: {stats['count']}",
+            f"Queue depth: {stats['queue_depth']} (max: {stats['max_queue_depth']})",
+            f"Round-trip latency: {stats['mean_latency_ms']:.1f} ms mean, {stats['max_latency_ms']:.1f} ms max",
+            f"Timeouts: {stats['timeouts']}",
+        ])
+        showinfo("Engine Request Statistics", message_text, parent=self.parent)
 
     def new_sound_file(self):
-        self.config_ref.sounds.clear()
+        sound_config.copy_sound_config(self.config_ref, sound_config.SoundConfig())
+        self.save_path = None
         self._call_changed_handler()
 
     def open_sound_file(self):
         filename = askopenfilename(filetypes=[("Soundboard YAML", "*.yaml")])
         if len(filename) > 0:
             sc = sound_config.get_sound_config(filename)
-            self.config_ref.sounds = sc.sounds
+            sound_config.copy_sound_config(self.config_ref, sc)
+            self.save_path = filename
             self._call_changed_handler()
+            self.autosaved_change_count = self.change_count
 
     def show_midi_devices(self):
-        device_list = self.request_handler(UiManagerRequests.GET_MIDI_DEVICES)
-        message_text = "List of input devices:\n"
-        message_text += "\n".join([f"{e['Id']}: {e['Name']}" for e in filter(lambda e: e["Input"], device_list)])
-        message_text += "\n"
-        message_text += "List of output devices:\n"
-        message_text += "\n".join([f"{e['Id']}: {e['Name']}" for e in filter(lambda e: e["Output"], device_list)])
-        showinfo("List of Midi Devices", message_text, parent=self.parent)
+        def device_list_handler(device_list):
+            message_text = "List of input devices:\n"
+            message_text += "\n".join([f"{e['Id']}: {e['Name']}" for e in filter(lambda e: e["Input"], device_list)])
+            message_text += "\n"
+            message_text += "List of output devices:\n"
+            message_text += "\n".join([f"{e['Id']}: {e['Name']}" for e in filter(lambda e: e["Output"], device_list)])
+            showinfo("List of Midi Devices", message_text, parent=self.parent)
+        self.call_engine(UiManagerRequests.GET_MIDI_DEVICES, device_list_handler)
 
     def on_save_handler(self):
         filename = asksaveasfilename(initialfile="Soundboard.yaml", defaultextension=".yaml", filetypes=[("Soundboard YAML", "*.yaml")])
         if len(filename) > 0:
-            with open(filename, "w") as f:
-                f.write("""# yaml-language-server: $schema=sound_config_schema.json
-
-""")
-                yaml.dump(
-                    self.config_ref.model_dump(mode="json"),
-                    f,
-                    indent=2
-                )
-                f.close()
-
-            env = jinja2.Environment(
-                loader=jinja2.FileSystemLoader("."),
-                autoescape=jinja2.select_autoescape(["html", "xml"])
+            self.save_path = filename
+            # the autosave would only write the same board again
+            self.autosaved_change_count = self.change_count
+            self.watch_future(
+                self.board_writer.save(self.config_ref, filename, self.dim),
+                on_error=partial(self.show_save_error, filename),
+                timeout=SAVE_TIMEOUT
             )
-            template = env.get_template("overview.html.template")
 
-            grid = [ [''] * self.dim[0] for _ in range(self.dim[1])]
-            for se in self.config_ref.sounds:
-                grid[self.dim[1] - 1 - se.y][se.x] = se.text
+    def autosave(self):
+        if self.save_path is not None and self.change_count != self.autosaved_change_count:
+            self.autosaved_change_count = self.change_count
+            path = pathlib.Path(self.save_path)
+            self.watch_future(
+                self.board_writer.save(self.config_ref, path.with_suffix(".autosave.yaml"), self.dim, with_overview=False),
+                on_error=partial(self.show_save_error, path.with_suffix(".autosave.yaml")),
+                timeout=SAVE_TIMEOUT
+            )
+        self.parent.after(self.autosave_interval * 1000, self.autosave)
 
-            html = template.render(rows=grid, width = 100.0 / self.dim[0])
-            filepath = pathlib.Path(filename)
-            with open(filepath.with_suffix(".html"), "w", encoding="utf-8") as f:
-                f.write(html)
+    def show_save_error(self, filename: str, error: Exception):
+        showwarning("Warning", f"Can't save {filename}: {error}", parent=self.parent)
 
     def _call_changed_handler(self):
-        self.request_handler(UiManagerRequests.RELOAD_AFTER_CONFIG_CHANGE)
+        self.change_count += 1
+        # the engine handles the requests in order, so the error positions are requested after the reload
+        self.call_engine(UiManagerRequests.RELOAD_AFTER_CONFIG_CHANGE)
         self.reload_changed_config()
 
     def find_entry_for_xy(self, x: int, y: int) -> sound_config.SoundEntry | None:
-        for sound in self.config_ref.sounds:
-            if sound.x == x and sound.y == y:
-                return sound
-        return None
+        return self.entries.get((x, y))
 
     def on_mouse_down(self, event):
         if isinstance(event.widget, tk.Button):
@@ -296,67 +711,97 @@ class UiManager:
                     b.y = a_xy[1]
                 self._call_changed_handler()
 
-    def reload_changed_config(self):
-        for widget in self.button_frame.winfo_children():
-            widget.destroy()
-        
-        def open_dialog_for_entry(entry: sound_config.SoundEntry):
-            diag = UiEntryManager(self.parent, entry)
-            self.parent.wait_window(diag.top)
-            match diag.result:
-                case "UNCHANGED":
-                    return
-                case None:
-                    idx = self.config_ref.sounds.index(entry)
-                    del self.config_ref.sounds[idx]
-                    self._call_changed_handler()
-                case sound_config.SoundEntry():
-                    self._call_changed_handler()
-            del diag
-
-        def open_dialog_for_new_entry(x: int, y: int):
-            new_entry = sound_config.SoundEntry(
-                text="New",
-                x=x,
-                y=y,
-                files=[],
-                file_select=sound_config.SoundFileSelect.SEQUENCE,
-                mode=sound_config.SoundPlayMode.PLAY_AND_STOP
-            )
-            diag = UiEntryManager(self.parent, new_entry)
-            self.parent.wait_window(diag.top)
-            match diag.result:
-                case "UNCHANGED" | None:
-                    return
-                case sound_config.SoundEntry():
-                    self.config_ref.sounds.append(diag.result)
-                    self._call_changed_handler()
-            del diag
-
-        disabled_buttons = self.request_handler(UiManagerRequests.GET_SOUND_ERROR_POSITIONS)
-        
+    def create_buttons(self):
         for xi in range(self.dim[0]):
             for yi in range(self.dim[1]):
-                se = self.find_entry_for_xy(xi, yi)
-                kwargs = {
-                    "text": se.text if se is not None else "-",
-                }
-                if (xi, yi) in disabled_buttons:
-                    kwargs["bg"] = "lightgray"
-                if se is None:
-                    kwargs["command"] = partial(open_dialog_for_new_entry, xi, yi)
-                else:
-                    kwargs["command"] = partial(open_dialog_for_entry, se)
-                btn = tk.Button(self.button_frame, **kwargs)
+                btn = tk.Button(self.button_frame, command=partial(self.on_button_click, xi, yi))
                 btn.bind("<ButtonPress-1>", self.on_mouse_down)
                 btn.bind("<ButtonRelease-1>", self.on_mouse_up)    
                 btn.grid(column=xi, row=self.dim[1] - 1 - yi, sticky=tk.NSEW, padx=2, pady=2)
+                self.buttons[(xi, yi)] = btn
+        self.default_bg = next(iter(self.buttons.values())).cget("bg")
+
+    def on_button_click(self, x: int, y: int):
+        se = self.find_entry_for_xy(x, y)
+        if se is None:
+            self.open_dialog_for_new_entry(x, y)
+        else:
+            self.open_dialog_for_entry(se)
+
+    def open_dialog_for_entry(self, entry: sound_config.SoundEntry):
+        diag = UiEntryManager(self.parent, entry, self.library)
+        self.parent.wait_window(diag.top)
+        match diag.result:
+            case "UNCHANGED":
+                return
+            case None:
+                idx = self.config_ref.sounds.index(entry)
+                del self.config_ref.sounds[idx]
+                self._call_changed_handler()
+            case sound_config.SoundEntry():
+                self._call_changed_handler()
+        del diag
+
+    def open_dialog_for_new_entry(self, x: int, y: int):
+        new_entry = sound_config.SoundEntry(
+            text="New",
+            x=x,
+            y=y,
+            files=[],
+            file_select=sound_config.SoundFileSelect.SEQUENCE,
+            mode=sound_config.SoundPlayMode.PLAY_AND_STOP
+        )
+        diag = UiEntryManager(self.parent, new_entry, self.library)
+        self.parent.wait_window(diag.top)
+        match diag.result:
+            case "UNCHANGED" | None:
+                return
+            case sound_config.SoundEntry():
+                self.config_ref.sounds.append(diag.result)
+                self._call_changed_handler()
+        del diag
+
+    def reload_changed_config(self):
+        self.entries = {(se.x, se.y): se for se in self.config_ref.sounds}
+        for xy in self.buttons:
+            self.update_button(xy)
+
+        def disabled_positions_handler(disabled_positions):
+            self.disabled_positions = set(tuple(xy) for xy in disabled_positions)
+            for xy in self.buttons:
+                self.update_button(xy)
+        self.call_engine(UiManagerRequests.GET_SOUND_ERROR_POSITIONS, disabled_positions_handler)
+
+    def draw_queued_states(self):
+        states = self.state_queue.drain()
+        self.sound_states.update(states)
+        for xy in states:
+            if xy in self.buttons:
+                self.update_button(xy)
+        self.parent.after(1000 // UI_FRAME_RATE, self.draw_queued_states)
+
+    def update_button(self, xy: tuple[int, int]):
+        se = self.entries.get(xy)
+        options = {
+            "text": se.text if se is not None else "-",
+            "bg": self.default_bg,
+        }
+        state = self.sound_states.get(xy)
+        if se is not None and state is not None and state.playing:
+            playing_color, paused_color = STATE_COLORS[state.mode]
+            options["bg"] = paused_color if state.paused else playing_color
+        elif xy in self.disabled_positions:
+            options["bg"] = "lightgray"
+        if options != self.button_options.get(xy):
+            self.buttons[xy].configure(**options)
+            self.button_options[xy] = options
 
 def run_ui(*args, **kwargs):
     def _run_ui(*args, **kwargs):
         root = TkinterDnD.Tk()
         ui = UiManager(root, *args, **kwargs)
         root.mainloop()
+        ui.board_writer.shutdown()
         del ui
 
     thread = threading.Thread(
@@ -368,11 +813,86 @@ def run_ui(*args, **kwargs):
     thread.start()
     return thread
 
-def create_async_request_handler(event_loop, handler):
-    def async_func(request, q, *args):
-        q.put(handler(request, *args))
-    def thread_func(request, *args):
-        q = Queue()
-        event_loop.call_soon_threadsafe(async_func, request, q, *args)
-        return q.get()
-    return thread_func
\ No newline at end of file
+class UiRequestBridge:
+    """
+    A class to send requests from the UI thread to a handler in the asyncio event loop without blocking.
+
+    Every request returns a concurrent.futures.Future. The queue depth and the round-trip latency of the requests are tracked.
+    """
+
+    def __init__(self, event_loop, handler: Callable[..., Any]):
+        """
+        Args:
+            event_loop: The asyncio event loop to run the handler in.
+            handler: A callable which is called with the request and its arguments. It can return an awaitable for slow requests.
+
+        """
+        self.event_loop = event_loop
+        self.handler = handler
+        self.lock = threading.Lock()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.count = 0
+        self.timeouts = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def request(self, request: UiManagerRequests, *args) -> Future:
+        """
+        Returns a future for the result of the request. Cancelling the future before the engine starts it skips the request.
+        """
+        future = Future()
+        start = time.perf_counter()
+        with self.lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        future.add_done_callback(partial(self._on_done, start))
+        self.event_loop.call_soon_threadsafe(self._run, future, request, args)
+        return future
+
+    def _run(self, future: Future, request: UiManagerRequests, args):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = self.handler(request, *args)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        if inspect.isawaitable(result):
+            def transfer(task):
+                if task.cancelled():
+                    future.set_exception(CancelledError())
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+            asyncio.ensure_future(result).add_done_callback(transfer)
+        else:
+            future.set_result(result)
+
+    def _on_done(self, start: float, future: Future):
+        latency = time.perf_counter() - start
+        with self.lock:
+            self.queue_depth -= 1
+            if not future.cancelled():
+                self.count += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def count_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def get_statistics(self) -> dict[str, Any]:
+        """
+        Returns the number of answered requests, the queue depth, the round-trip latency and the number of timeouts.
+        """
+        with self.lock:
+            return {
+                "count": self.count,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "mean_latency_ms": 1000.0 * self.total_latency / self.count if self.count > 0 else 0.0,
+                "max_latency_ms": 1000.0 * self.max_latency,
+                "timeouts": self.timeouts,
+            }